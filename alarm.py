@@ -0,0 +1,213 @@
+from threading import Thread, Condition, Event
+from collections import deque
+import platform
+import metrics
+import time
+
+# Alarm states
+IDLE = "idle"
+WARNING = "warning"
+ALARM = "alarm"
+ACKNOWLEDGED = "acknowledged"
+
+# One-byte codes for the alarm states in binary records and messages
+STATE_CODES = {IDLE: 0, WARNING: 1, ALARM: 2, ACKNOWLEDGED: 3}
+STATES_BY_CODE = {code: state for (state, code) in STATE_CODES.items()}
+
+# Precomputed (sound_on, seconds) steps, repeated for as long as the state lasts
+PATTERNS = {
+    WARNING: ((True, 0.5), (False, 0.5)),
+    ALARM: ((True, 1.5), (False, 0.25)),
+}
+
+# An acknowledged alarm stays silent for this long, or until the eyes open again
+ACKNOWLEDGE_SECONDS = 10.0
+
+TONE_FREQUENCY = 1000
+
+
+class GpioBackend:
+    """Sound the buzzer wired to the Raspberry Pi's GPIO pin."""
+
+    def __init__(self):
+        import buzzer
+
+        self.buzzer = buzzer
+        self.buzzer.setup_pins()
+
+    def play(self, seconds, interrupted):
+        """Sound for the given time, stopping early if interrupted is set."""
+        self.buzzer.power_buzzer_on()
+        interrupted.wait(seconds)
+        self.buzzer.power_buzzer_off()
+
+    def close(self):
+        """Silence the buzzer and release the pins."""
+        self.buzzer.power_buzzer_off()
+        self.buzzer.clean_pins_up()
+
+
+class HostSoundBackend:
+    """Beep through the host's speaker (winsound on Windows, terminal bell elsewhere)."""
+
+    def __init__(self, frequency=TONE_FREQUENCY):
+        self.frequency = frequency
+
+        try:
+            import winsound
+            self.winsound = winsound
+
+        except ImportError:
+            self.winsound = None
+
+    def play(self, seconds, interrupted):
+        """Sound for the given time; winsound beeps cannot be cut short."""
+        if self.winsound is not None:
+            self.winsound.Beep(self.frequency, int(seconds * 1000))
+
+        else:
+            print("\a", end="", flush=True)
+            interrupted.wait(seconds)
+
+    def close(self):
+        """Nothing to release."""
+
+
+class RecordingBackend:
+    """Record what would have been played instead of making any sound (for tests)."""
+
+    def __init__(self):
+        self.played = []
+        self.closed = False
+
+    def play(self, seconds, interrupted):
+        """Record the start time and length of a tone, then wait it out."""
+        self.played.append((time.monotonic(), seconds))
+        interrupted.wait(seconds)
+
+    def close(self):
+        """Mark the backend closed."""
+        self.closed = True
+
+
+ALARM_BACKENDS = {
+    "gpio": GpioBackend,
+    "sound": HostSoundBackend,
+    "recording": RecordingBackend,
+}
+
+
+def default_backend_name():
+    """Use the buzzer on the Raspberry Pi and the host speaker everywhere else."""
+    return "gpio" if platform.machine().startswith(("arm", "aarch")) else "sound"
+
+
+def create_backend(name=None):
+    """Create an alarm backend by name."""
+    return ALARM_BACKENDS[name or default_backend_name()]()
+
+
+class AlarmController:
+    """Play alarm patterns on a background thread, driven by posted state changes.
+
+    post() only records the new state and wakes the thread, so the detection loop
+    never waits on the alarm.
+    """
+
+    def __init__(self, backend, acknowledge_seconds=ACKNOWLEDGE_SECONDS):
+        self.backend = backend
+        self.acknowledge_seconds = acknowledge_seconds
+
+        self.condition = Condition()
+        self.interrupted = Event()
+        self.state = IDLE
+        self.generation = 0
+        self.posted_at = None
+        self.acknowledged_until = 0.0
+        self.stopped = False
+
+        self.onset_latencies = deque(maxlen=1000)
+        self.thread = Thread(target=self.run, name="alarm", daemon=True)
+
+    def start(self):
+        """Start the alarm thread."""
+        self.thread.start()
+        return self
+
+    def post(self, state):
+        """Request a state (IDLE, WARNING or ALARM) without waiting for it to sound."""
+        if state == self.state:
+            return
+
+        with self.condition:
+            if self.state == ACKNOWLEDGED and state != IDLE:
+                if time.monotonic() < self.acknowledged_until:
+                    return
+
+            self.set_state(state)
+
+    def acknowledge(self):
+        """Silence the current alarm until the driver's eyes open or the timeout lapses."""
+        with self.condition:
+            if self.state in (WARNING, ALARM):
+                self.acknowledged_until = time.monotonic() + self.acknowledge_seconds
+                self.set_state(ACKNOWLEDGED)
+
+    def set_state(self, state):
+        """Switch state and interrupt the pattern being played (condition must be held)."""
+        if state in PATTERNS and self.state not in PATTERNS:
+            metrics.ALARMS_FIRED.inc()
+
+        self.state = state
+        self.generation += 1
+        self.posted_at = time.perf_counter()
+        self.interrupted.set()
+        self.condition.notify()
+
+    def stop(self):
+        """Stop the alarm thread and release the backend."""
+        with self.condition:
+            self.stopped = True
+            self.interrupted.set()
+            self.condition.notify()
+
+        if self.thread.is_alive():
+            self.thread.join(2.0)
+
+        self.backend.close()
+
+    def run(self):
+        """Play the pattern of the current state until the state changes."""
+        while True:
+            with self.condition:
+                while not self.stopped and self.state not in PATTERNS:
+                    self.condition.wait()
+
+                if self.stopped:
+                    return
+
+                state = self.state
+                generation = self.generation
+                posted_at = self.posted_at
+                self.interrupted.clear()
+
+            self.play_pattern(PATTERNS[state], generation, posted_at)
+
+    def play_pattern(self, pattern, generation, posted_at):
+        """Repeat a pattern until the state changes, recording the first tone's onset latency."""
+        while self.generation == generation and not self.stopped:
+            for (sound_on, seconds) in pattern:
+                if self.generation != generation or self.stopped:
+                    return
+
+                if not sound_on:
+                    self.interrupted.wait(seconds)
+                    continue
+
+                if posted_at is not None:
+                    latency = time.perf_counter() - posted_at
+                    self.onset_latencies.append(latency)
+                    metrics.ALARM_ONSET_LATENCY.observe(latency)
+                    posted_at = None
+
+                self.backend.play(seconds, self.interrupted)
@@ -0,0 +1,223 @@
+from multiprocessing import Pool
+import numpy as np
+import argparse
+import json
+import os
+import model
+import cv2
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".h264")
+
+# Each chunk also decodes this many seconds before its start so the face
+# tracker has locked on by the time the chunk's own frames begin
+CHUNK_SECONDS = 60
+OVERLAP_SECONDS = 2
+
+# A drowsy episode is a run of closed-eye frames at least this long
+MIN_EPISODE_SECONDS = 1.0
+
+
+def find_videos(paths):
+    """Expand the given files and directories into a sorted list of video files."""
+    videos = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for (root, _, files) in os.walk(path):
+                videos.extend(
+                    os.path.join(root, name) for name in files
+                    if name.lower().endswith(VIDEO_EXTENSIONS)
+                )
+
+        else:
+            videos.append(path)
+
+    return sorted(videos)
+
+
+def output_names(paths):
+    """Map each video to a unique output name, without the extension.
+
+    Names are paths relative to the directory a video was found under, so
+    truck1/day.mp4 and truck2/day.mp4 do not overwrite each other's results.
+    """
+    names = {}
+    used = set()
+
+    for path in paths:
+        root = path if os.path.isdir(path) else os.path.dirname(path)
+
+        for video_path in find_videos([path]):
+            if video_path in names:
+                continue
+
+            base = os.path.splitext(os.path.relpath(video_path, root))[0]
+            name = base
+            suffix = 2
+
+            # Files given separately can still share a relative name
+            while name in used:
+                name = f"{base}_{suffix}"
+                suffix += 1
+
+            used.add(name)
+            names[video_path] = name
+
+    return names
+
+
+def split_into_chunks(video_path, chunk_seconds=CHUNK_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """Split a video into (path, fps, warmup_start, start, end) frame ranges."""
+    capture = cv2.VideoCapture(video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+
+    # Some containers do not report a frame count; read them in one pass
+    if frame_count <= 0:
+        return [(video_path, fps, 0, 0, None)]
+
+    chunk_frames = max(int(chunk_seconds * fps), 1)
+    overlap_frames = int(overlap_seconds * fps)
+
+    return [
+        (video_path, fps, max(start - overlap_frames, 0), start, min(start + chunk_frames, frame_count))
+        for start in range(0, frame_count, chunk_frames)
+    ]
+
+
+def analyze_chunk(chunk):
+    """Compute the EAR of every frame in a chunk (NaN where no face is found)."""
+    (video_path, fps, warmup_start, start, end) = chunk
+
+    face_tracker = model.FaceTracker()
+    frame_context = model.FrameContext()
+
+    capture = cv2.VideoCapture(video_path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+
+    ear_values = []
+    frame_index = warmup_start
+
+    while end is None or frame_index < end:
+        (ret, frame) = capture.read()
+
+        if not ret:
+            break
+
+        resized_frame = frame_context.prepare(frame)
+        face = face_tracker.detect(resized_frame, frame_context.gray)
+
+        # Warm-up frames only prime the tracker
+        if frame_index >= start:
+            if face is None:
+                ear_values.append(np.nan)
+
+            else:
+                eye_landmarks = model.get_eye_landmarks(resized_frame, face, frame_context.gray)
+                ear_values.append(model.calculate_average_ear(eye_landmarks))
+
+        frame_index += 1
+
+    capture.release()
+
+    ear_values = np.asarray(ear_values, dtype=np.float32)
+    timestamps = (start + np.arange(len(ear_values))) / fps
+
+    return (video_path, start, timestamps, ear_values)
+
+
+def find_drowsy_episodes(timestamps, ear_values, threshold=model.EAR_THRESHOLD,
+                         min_seconds=MIN_EPISODE_SECONDS):
+    """Summarize runs of frames whose EAR is below the threshold."""
+    closed = np.zeros(len(ear_values) + 2, dtype=np.int8)
+    closed[1:-1] = ear_values < threshold
+
+    edges = np.flatnonzero(np.diff(closed))
+    (starts, ends) = (edges[0::2], edges[1::2])
+
+    episodes = []
+
+    for (first, last) in zip(starts, ends):
+        duration = float(timestamps[last - 1] - timestamps[first])
+
+        if duration >= min_seconds:
+            episode_ears = ear_values[first:last]
+            episodes.append({
+                "start": float(timestamps[first]),
+                "end": float(timestamps[last - 1]),
+                "duration": duration,
+                "min_ear": float(episode_ears.min()),
+                "mean_ear": float(episode_ears.mean()),
+            })
+
+    return episodes
+
+
+def save_results(output_dir, name, video_path, timestamps, ear_values, episodes):
+    """Write a video's EAR series (.npz) and drowsy-episode summary (.json) under its output name."""
+    os.makedirs(os.path.dirname(os.path.join(output_dir, name)), exist_ok=True)
+
+    np.savez_compressed(
+        os.path.join(output_dir, f"{name}.npz"),
+        timestamps=timestamps,
+        ear=ear_values,
+    )
+
+    with open(os.path.join(output_dir, f"{name}_episodes.json"), "w") as episodes_file:
+        json.dump({"video": video_path, "episodes": episodes}, episodes_file, indent=2)
+
+
+def analyze_videos(paths, output_dir, workers=None, chunk_seconds=CHUNK_SECONDS,
+                   overlap_seconds=OVERLAP_SECONDS, min_episode_seconds=MIN_EPISODE_SECONDS):
+    """Analyze every video across a process pool and save its EAR series and episodes."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    names = output_names(paths)
+
+    chunks = [
+        chunk
+        for video_path in sorted(names)
+        for chunk in split_into_chunks(video_path, chunk_seconds, overlap_seconds)
+    ]
+
+    results = {}
+
+    with Pool(workers) as pool:
+        for (video_path, start, timestamps, ear_values) in pool.imap_unordered(analyze_chunk, chunks):
+            results.setdefault(video_path, []).append((start, timestamps, ear_values))
+
+    for (video_path, parts) in sorted(results.items()):
+        parts.sort(key=lambda part: part[0])
+        timestamps = np.concatenate([part[1] for part in parts])
+        ear_values = np.concatenate([part[2] for part in parts])
+
+        episodes = find_drowsy_episodes(timestamps, ear_values, min_seconds=min_episode_seconds)
+        save_results(output_dir, names[video_path], video_path, timestamps, ear_values, episodes)
+
+        print(f"{video_path}: {len(ear_values)} frames, {len(episodes)} drowsy episodes")
+
+
+def main():
+    """Parse command line arguments and analyze the given recordings."""
+    parser = argparse.ArgumentParser(description="Compute per-frame EAR series for recorded videos.")
+    parser.add_argument("paths", nargs="+", help="video files or directories containing videos")
+    parser.add_argument("-o", "--output-dir", default="ear_analysis")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS)
+    parser.add_argument("--overlap-seconds", type=float, default=OVERLAP_SECONDS)
+    parser.add_argument("--min-episode-seconds", type=float, default=MIN_EPISODE_SECONDS)
+    args = parser.parse_args()
+
+    analyze_videos(
+        args.paths,
+        args.output_dir,
+        workers=args.workers,
+        chunk_seconds=args.chunk_seconds,
+        overlap_seconds=args.overlap_seconds,
+        min_episode_seconds=args.min_episode_seconds,
+    )
+
+
+if __name__ == "__main__":
+    main()
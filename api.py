@@ -1,10 +1,25 @@
 from database import register_user, initialize_users_table, login_user
-from flask import Flask, request, jsonify, session
-import bcrypt
+from database import get_drowsiness_events, get_hourly_drowsiness_stats
+from database import EVENT_PAGE_SIZE, MAX_EVENT_PAGE_SIZE
+from flask import Flask, Response, request, jsonify, session
+import driver_session
+import database
+import live_stream
+import passwords
+import metrics
+import math
 
 app = Flask(__name__)
 app.secret_key = "super_secret_key_0123456789"
 
+API_HOST = "0.0.0.0"
+API_PORT = 5000
+
+@app.teardown_appcontext
+def return_database_connection(exception):
+    """Give the request thread's database connection back to the pool for the next request."""
+    database.return_connection()
+
 @app.route("/register", methods=["POST"])
 def register():
     """Endpoint to register a new user."""
@@ -17,15 +32,14 @@ def register():
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
 
-    hashed_password = bcrypt.hashpw(password.encode("UTF-8"), bcrypt.gensalt())
+    # register_user hashes the password itself
+    (registration_success, message) = register_user(username, password, fullname)
 
-    registration_result = register_user(username, hashed_password, fullname)
-
-    if registration_result:
+    if registration_success:
         return jsonify({"message": "User registered successfully"}), 201
 
     else:
-        return jsonify({"error": "Username already exists"}), 400
+        return jsonify({"error": message}), 400
 
 
 @app.route("/login", methods=["POST"])
@@ -39,10 +53,11 @@ def login():
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
 
-    login_result = login_user(username, password)
+    (login_success, _) = login_user(username, password)
 
-    if login_result:
+    if login_success:
         session["username"] = username
+        driver_session.log_in(username)
         return jsonify({"message": f"User logged in successfully",
                         "username": username}), 200
 
@@ -53,18 +68,109 @@ def login():
 def logout():
     """Endpoint to log out a user."""
     session.pop("username", None)
+    driver_session.log_out()
     return jsonify({"message": "User logged out successfully"}), 200
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Endpoint exposing pipeline counters and latency histograms in Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/live", methods=["GET"])
+def get_live_stream():
+    """Endpoint streaming live EAR samples, at the requested `rate`, and state changes as Server-Sent Events."""
+    rate = request.args.get("rate", live_stream.DEFAULT_RATE, type=float)
+
+    if not math.isfinite(rate):
+        return jsonify({"error": "Invalid rate"}), 400
+
+    return Response(live_stream.stream(rate), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def get_time_range():
+    """Read the optional `start` and `end` epoch-second query parameters."""
+
+    start = request.args.get("start", type=int)
+    end = request.args.get("end", type=int)
+    return start, end
+
+@app.route("/events", methods=["GET"])
+def get_events():
+    """Endpoint returning one page of the logged-in driver's drowsiness events, oldest first.
+
+    The response's `next_cursor` is passed back as `after` to fetch the next page.
+    """
+
+    # Drivers only ever see their own events
+    username = session.get("username")
+
+    if not username:
+        return jsonify({"error": "Not logged in"}), 401
+
+    (start, end) = get_time_range()
+    limit = min(max(request.args.get("limit", EVENT_PAGE_SIZE, type=int), 1), MAX_EVENT_PAGE_SIZE)
+    after = request.args.get("after")
+
+    if after is not None:
+        try:
+            (after_timestamp, after_id) = after.split(":")
+            after = (int(after_timestamp), int(after_id))
+
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    (success, result) = get_drowsiness_events(username, start, end, after, limit)
+
+    if not success:
+        return jsonify({"error": result}), 404
+
+    events = [
+        {"id": event_id, "timestamp": timestamp, "ear_value": ear_value}
+        for (event_id, timestamp, ear_value) in result
+    ]
+    next_cursor = f"{events[-1]['timestamp']}:{events[-1]['id']}" if len(events) == limit else None
+
+    return jsonify({"events": events, "next_cursor": next_cursor}), 200
+
+@app.route("/events/stats", methods=["GET"])
+def get_event_stats():
+    """Endpoint returning per-hour event counts and min/mean EAR of the logged-in driver."""
+
+    # Drivers only ever see their own events
+    username = session.get("username")
+
+    if not username:
+        return jsonify({"error": "Not logged in"}), 401
+
+    (start, end) = get_time_range()
+    (success, result) = get_hourly_drowsiness_stats(username, start, end)
+
+    if not success:
+        return jsonify({"error": result}), 404
+
+    hours = [
+        {"hour": hour, "count": count, "min_ear": min_ear, "mean_ear": mean_ear}
+        for (hour, count, min_ear, mean_ear) in result
+    ]
+
+    return jsonify({"hours": hours}), 200
+
 def get_login_status():
-    """Check if a user is logged in and return the status."""
+    """Check if a driver is logged in and return the status."""
 
-    with app.test_request_context():
-        if "username" in session:
-            return {"logged_in": True, "username": session["username"]}
+    username = driver_session.current_driver
+
+    if username is not None:
+        return {"logged_in": True, "username": username}
+
+    else:
+        return {"logged_in": False}
 
-        else:
-            return {"logged_in": False}
+def run_server(host=API_HOST, port=API_PORT):
+    """Serve the API; safe to call from a background thread."""
+    app.run(host=host, port=port, threaded=True, use_reloader=False)
 
 if __name__ == "__main__":
+    passwords.start()
     initialize_users_table()
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    run_server()
\ No newline at end of file
@@ -1,9 +1,9 @@
 from imutils import face_utils
-from threading import Thread
+from model import calculate_ear_batch
 import numpy as np
 import database
 import logging
-import buzzer
+import alarm
 import dlib
 import cv2
 
@@ -17,6 +17,7 @@ detector = dlib.get_frontal_face_detector()
 predictor = dlib.shape_predictor("68_face_landmarks_shape_predictor.dat")
 
 alarm_status = False
+alarm_controller = None
 frame_count = 0
 counter = 0
 
@@ -42,12 +43,7 @@ def calculate_ear(eye):
 def get_final_ear(face_landmarks):
     """Calculate the average EAR for both eyes."""
 
-    left_eye = face_landmarks[left_eye_start:left_eye_end]
-    right_eye = face_landmarks[right_eye_start:right_eye_end]
-
-    left_ear = calculate_ear(left_eye)
-    right_ear = calculate_ear(right_eye)
-    return (left_ear + right_ear) / 2
+    return calculate_ear_batch(face_landmarks[np.newaxis])[0]
 
 def detect_drowsiness(ear_value):
     """Detect drowsiness based on EAR value."""
@@ -58,13 +54,13 @@ def detect_drowsiness(ear_value):
         if counter >= CONSECUTIVE_FRAMES:
             if not alarm_status:
                 alarm_status = True
-                Thread(target=buzzer.start_alarm, daemon=True).start()
+                alarm_controller.post(alarm.ALARM)
                 logging.info(f"Drowsiness detected at frame {frame_count}")
 
     else:
         counter = 0
         alarm_status = False
-        buzzer.power_buzzer_off()
+        alarm_controller.post(alarm.IDLE)
 
 def draw_face_landmarks(face, landmarks):
     """Draw landmarks on the face."""
@@ -102,6 +98,9 @@ def process_frame(frame):
 
 def main():
     """Main function to start the drowsiness detection system."""
+    global alarm_controller
+
+    alarm_controller = alarm.AlarmController(alarm.create_backend("gpio")).start()
     database.initialize_drowsiness_events()
     capture = cv2.VideoCapture(0)
 
@@ -121,7 +120,7 @@ def main():
 
     capture.release()
     cv2.destroyAllWindows()
-    buzzer.clean_pins_up()
+    alarm_controller.stop()
 
 if __name__ == "__main__":
     main()
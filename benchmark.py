@@ -0,0 +1,428 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import subprocess
+import tempfile
+import platform
+import argparse
+import json
+import time
+import os
+import drowsiness_engine
+import passwords
+import database
+import alarm
+import model
+import dlib
+import api
+import cv2
+
+BENCHMARK_USERNAME = "benchmark_driver"
+
+# Eye closures replayed by check_adaptive_sampling, in seconds, between
+# clearly open eyes (sparsest sampling) and clearly closed ones
+CHECK_CLOSURE_SECONDS = [round(0.1 + 0.05 * step, 2) for step in range(39)]
+CHECK_OPEN_EAR = 0.45
+CHECK_CLOSED_EAR = 0.15
+
+
+def synthetic_frames(count, width=640, height=480, seed=0):
+    """Generate reproducible noise frames with a bright face-sized ellipse in the middle."""
+    rng = np.random.default_rng(seed)
+    frames = []
+
+    for _ in range(count):
+        frame = rng.integers(0, 64, size=(height, width, 3), dtype=np.uint8)
+        cv2.ellipse(frame, (width // 2, height // 2), (width // 8, height // 5), 0, 0, 360, (200, 180, 170), -1)
+        frames.append(frame)
+
+    return frames
+
+
+def clip_frames(count, path):
+    """Load up to count frames from a recorded clip, looping it if it is shorter."""
+    capture = cv2.VideoCapture(path)
+    frames = []
+
+    while len(frames) < count:
+        (ret, frame) = capture.read()
+
+        if not ret:
+            if not frames:
+                raise ValueError(f"Could not read any frames from {path}")
+
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+
+        frames.append(frame)
+
+    capture.release()
+    return frames
+
+
+FRAME_SOURCES = {
+    "synthetic": synthetic_frames,
+    "clip": clip_frames,
+}
+
+
+def summarize(latencies):
+    """Return count, mean, p50/p95/p99 latency (ms) and throughput for a list of seconds."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+
+    if len(latencies) == 0:
+        return {"count": 0}
+
+    (p50, p95, p99) = np.percentile(latencies, [50, 95, 99]) * 1000.0
+    total = latencies.sum()
+
+    return {
+        "count": int(len(latencies)),
+        "mean_ms": float(latencies.mean() * 1000.0),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "throughput_per_s": float(len(latencies) / total) if total else None,
+    }
+
+
+def fallback_face(resized_frame):
+    """Return a centered box so landmarking is still timed when no face is detected."""
+    (height, width) = resized_frame.shape[:2]
+    return dlib.rectangle(width // 4, height // 6, width * 3 // 4, height * 5 // 6)
+
+
+def prepare_database(path):
+    """Point the database module at a scratch file containing the benchmark user."""
+    database.DATABASE_NAME = path
+    database.initialize_tables()
+    database.register_user(BENCHMARK_USERNAME, "benchmark", "Benchmark Driver")
+
+
+def benchmark_pipeline(frames, warmup=10):
+    """Time every detection pipeline stage, and the whole chain, on each frame."""
+    timings = {name: [] for name in (
+        "resize_frame",
+        "detect_first_face",
+        "get_face_landmarks",
+        "calculate_average_ear",
+        "get_login_status",
+        "insert_drowsiness_event",
+        "end_to_end",
+    )}
+    faces_found = 0
+
+    for (index, frame) in enumerate(frames):
+        started_at = time.perf_counter()
+
+        resized_frame = model.resize_frame(frame)
+        resized_at = time.perf_counter()
+
+        face = model.detect_first_face(resized_frame)
+        detected_at = time.perf_counter()
+
+        if face is None:
+            face = fallback_face(resized_frame)
+
+        else:
+            faces_found += 1
+
+        face_landmarks = model.get_face_landmarks(resized_frame, face)
+        landmarked_at = time.perf_counter()
+
+        ear_value = model.calculate_average_ear(face_landmarks)
+        ear_at = time.perf_counter()
+
+        api.get_login_status()
+        status_at = time.perf_counter()
+
+        database.insert_drowsiness_event(ear_value, BENCHMARK_USERNAME)
+        inserted_at = time.perf_counter()
+
+        if index < warmup:
+            continue
+
+        timings["resize_frame"].append(resized_at - started_at)
+        timings["detect_first_face"].append(detected_at - resized_at)
+        timings["get_face_landmarks"].append(landmarked_at - detected_at)
+        timings["calculate_average_ear"].append(ear_at - landmarked_at)
+        timings["get_login_status"].append(status_at - ear_at)
+        timings["insert_drowsiness_event"].append(inserted_at - status_at)
+        timings["end_to_end"].append(inserted_at - started_at)
+
+    return {
+        "stages": {name: summarize(latencies) for (name, latencies) in timings.items()},
+        "detection_rate": faces_found / len(frames) if frames else 0.0,
+    }
+
+
+def benchmark_detectors(frames, warmup=10, backends=None):
+    """Compare latency and detection rate of each face detector backend on the same frames.
+
+    Backends this install cannot run, or that fail, are reported as skipped
+    with the reason instead of ending the benchmark.
+    """
+    gray_frames = [cv2.cvtColor(model.resize_frame(frame), cv2.COLOR_BGR2GRAY) for frame in frames]
+    results = {}
+
+    for backend in backends or sorted(set(model.DETECTOR_BACKENDS) | set(model.UNAVAILABLE_DETECTORS)):
+        if backend in model.UNAVAILABLE_DETECTORS:
+            results[backend] = {"skipped": model.UNAVAILABLE_DETECTORS[backend]}
+            continue
+
+        latencies = []
+        faces_found = 0
+
+        try:
+            for (index, gray_frame) in enumerate(gray_frames):
+                started_at = time.perf_counter()
+                faces = model.detect_faces(gray_frame, backend)
+                finished_at = time.perf_counter()
+
+                if index < warmup:
+                    continue
+
+                latencies.append(finished_at - started_at)
+                faces_found += bool(faces)
+
+        except Exception as e:
+            results[backend] = {"skipped": f"failed: {e}"}
+            continue
+
+        results[backend] = summarize(latencies)
+        results[backend]["detection_rate"] = faces_found / len(latencies) if latencies else 0.0
+
+    return results
+
+
+def benchmark_alarm_onset(samples=50, timeout=1.0):
+    """Time from posting an alarm state to the alarm thread starting its first tone."""
+    controller = alarm.AlarmController(alarm.RecordingBackend()).start()
+
+    for _ in range(samples):
+        onsets = len(controller.onset_latencies)
+        controller.post(alarm.ALARM)
+
+        deadline = time.monotonic() + timeout
+        while len(controller.onset_latencies) == onsets and time.monotonic() < deadline:
+            time.sleep(0.0005)
+
+        controller.post(alarm.IDLE)
+
+    controller.stop()
+    return summarize(list(controller.onset_latencies))
+
+
+def replay_closure(closure_start, closure_end, fps, sampler=None):
+    """Replay open eyes with frames closure_start to closure_end - 1 closed, through a fresh engine.
+
+    Returns the (frame, state) changes among the processed frames and the first
+    closed frame processed (None if the sampler skipped them all).
+    """
+    engine = drowsiness_engine.DrowsinessEngine()
+    changes = []
+    first_closed = None
+
+    for frame in range(closure_end + int(1.5 * fps)):
+        timestamp = frame / fps
+
+        if sampler is not None and not sampler.should_process(timestamp):
+            continue
+
+        closed = closure_start <= frame < closure_end
+        previous_state = engine.state
+        state = engine.update(timestamp, CHECK_CLOSED_EAR if closed else CHECK_OPEN_EAR)
+
+        if sampler is not None:
+            sampler.record(CHECK_CLOSED_EAR if closed else CHECK_OPEN_EAR, state)
+
+        if closed and first_closed is None:
+            first_closed = frame
+
+        if state != previous_state:
+            changes.append((frame, state))
+
+    return (changes, first_closed)
+
+
+def check_adaptive_sampling(fps=30.0):
+    """Check that adaptive sampling only delays alarms and never changes which ones fire.
+
+    Every closure length is replayed at every phase relative to the sparse
+    sampling interval. The adaptive run must give exactly the state changes of
+    a full-rate run in which the eyes closed when the sampler first saw them.
+    """
+    phases = max(int(drowsiness_engine.MAX_SAMPLE_INTERVAL * fps), 1)
+    mismatches = []
+    latencies = []
+
+    for closure_seconds in CHECK_CLOSURE_SECONDS:
+        for phase in range(phases):
+            closure_start = int(3.0 * fps) + phase
+            closure_end = closure_start + int(round(closure_seconds * fps))
+
+            (adaptive_changes, first_closed) = replay_closure(
+                closure_start, closure_end, fps, drowsiness_engine.AdaptiveSampler())
+            seen_from = closure_end if first_closed is None else first_closed
+            (full_rate_changes, _) = replay_closure(seen_from, closure_end, fps)
+
+            latencies.append((seen_from - closure_start) / fps)
+
+            if adaptive_changes != full_rate_changes:
+                mismatches.append({
+                    "closure_seconds": closure_seconds,
+                    "phase": phase,
+                    "adaptive": adaptive_changes,
+                    "full_rate": full_rate_changes,
+                })
+
+    return {
+        "fps": fps,
+        "closures": len(latencies),
+        "mismatches": mismatches,
+        "max_latency_ms": max(latencies) * 1000.0,
+    }
+
+
+def benchmark_auth(requests=40, concurrency=8):
+    """Time concurrent /register and /login requests against the API, end to end."""
+    results = {}
+
+    def post(path, index):
+        started_at = time.perf_counter()
+        response = api.app.test_client().post(path, json={
+            "username": f"auth_user_{index}",
+            "password": f"password_{index}",
+            "fullname": "Benchmark Driver",
+        })
+        latency = time.perf_counter() - started_at
+
+        if response.status_code >= 400:
+            raise RuntimeError(f"{path} failed: {response.get_json()}")
+
+        return latency
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for path in ("/register", "/login"):
+            started_at = time.perf_counter()
+            latencies = list(executor.map(lambda index: post(path, index), range(requests)))
+            elapsed = time.perf_counter() - started_at
+
+            # Requests overlap, so throughput is measured on the wall clock
+            results[path] = summarize(latencies)
+            results[path]["throughput_per_s"] = requests / elapsed
+
+    results["concurrency"] = concurrency
+    results["bcrypt_rounds"] = passwords.BCRYPT_ROUNDS
+    results["pool_size"] = passwords.POOL_SIZE
+    return results
+
+
+def get_git_commit():
+    """Return the current git commit, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def describe_environment():
+    """Return the metadata needed to compare runs across commits and hardware."""
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": get_git_commit(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    """Parse command line arguments, run the benchmark and save the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the drowsiness detection pipeline stages.")
+    parser.add_argument("--source", choices=sorted(FRAME_SOURCES), default="synthetic")
+    parser.add_argument("--clip", help="recorded clip to replay (with --source clip)")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--compare-detectors", action="store_true",
+                        help="also compare every face detector backend on the same frames")
+    parser.add_argument("--auth", action="store_true",
+                        help="also benchmark concurrent /register and /login requests")
+    parser.add_argument("--auth-requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    source_options = {}
+
+    if args.source == "clip":
+        if not args.clip:
+            parser.error("--source clip requires --clip PATH")
+        source_options["path"] = args.clip
+
+    # Fork the password workers before the benchmark starts any thread
+    passwords.start()
+    frames = FRAME_SOURCES[args.source](args.frames + args.warmup, **source_options)
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        prepare_database(os.path.join(scratch_dir, "benchmark.db"))
+        pipeline_results = benchmark_pipeline(frames, warmup=args.warmup)
+        database.close_connection()
+
+        if args.auth:
+            pipeline_results["auth"] = benchmark_auth(args.auth_requests, args.concurrency)
+
+    pipeline_results["stages"]["alarm_onset"] = benchmark_alarm_onset()
+    pipeline_results["adaptive_sampling"] = check_adaptive_sampling()
+
+    if args.compare_detectors:
+        pipeline_results["detectors"] = benchmark_detectors(frames, warmup=args.warmup)
+
+    results = {
+        "environment": describe_environment(),
+        "source": args.source,
+        "clip": args.clip,
+        "frames": args.frames,
+        **pipeline_results,
+    }
+
+    with open(args.output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+    for (name, summary) in results["stages"].items():
+        print(f"{name:>24}: p50 {summary['p50_ms']:8.3f} ms  p95 {summary['p95_ms']:8.3f} ms  "
+              f"p99 {summary['p99_ms']:8.3f} ms  {summary['throughput_per_s']:10.1f}/s")
+
+    for (backend, summary) in results.get("detectors", {}).items():
+        if "skipped" in summary:
+            print(f"{'detector ' + backend:>24}: skipped, {summary['skipped']}")
+            continue
+
+        print(f"{'detector ' + backend:>24}: p50 {summary['p50_ms']:8.3f} ms  p95 {summary['p95_ms']:8.3f} ms  "
+              f"detection rate {summary['detection_rate']:.1%}")
+
+    for (path, summary) in results.get("auth", {}).items():
+        if isinstance(summary, dict):
+            print(f"{'auth ' + path:>24}: p50 {summary['p50_ms']:8.3f} ms  p95 {summary['p95_ms']:8.3f} ms  "
+                  f"{summary['throughput_per_s']:10.1f}/s")
+
+    sampling = results["adaptive_sampling"]
+    print(f"Adaptive sampling: {len(sampling['mismatches'])} of {sampling['closures']} closures changed the "
+          f"alarm states, detection latency up to {sampling['max_latency_ms']:.0f} ms")
+
+    print(f"Detection rate: {results['detection_rate']:.1%}. Results saved to {args.output}")
+
+    if sampling["mismatches"]:
+        raise SystemExit("Adaptive sampling changed the alarm states of some closures")
+
+
+if __name__ == "__main__":
+    main()
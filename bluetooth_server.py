@@ -1,52 +1,361 @@
-import bluetooth
-from flask import Flask, request, jsonify
+from threading import Thread, Event
+import driver_session
+import passwords
+import database
+import asyncio
+import logging
+import socket
+import struct
+import alarm
+import math
+import time
 
-app = Flask(__name__)
+# Every message is a header (message type, payload length) followed by the payload
+HEADER = struct.Struct("!BH")
+MAX_PAYLOAD = 1024
 
-@app.route("/login", methods=["POST"])
-def login():
-    request_body = request.json
-    username = request_body.get("username")
-    password = request_body.get("password")
+# Client requests
+LOGIN = 0x01        # username, NUL, password (UTF-8)
+LOGOUT = 0x02
+SUBSCRIBE = 0x03    # optional uint8: most telemetry messages per second wanted
+UNSUBSCRIBE = 0x04
+ACKNOWLEDGE = 0x05  # silence the current alarm
+PING = 0x06
 
-    if not username or not password:
-        return jsonify({"error": "Username and password are required"}), 400
+# Server messages
+RESULT = 0x81       # uint8 status (0 = ok), then a UTF-8 message
+TELEMETRY = 0x82    # TELEMETRY_RECORD
 
-    login_result = login_user(username, password)
+# Timestamp (Unix seconds), EAR (NaN when no face) and alarm state code
+TELEMETRY_RECORD = struct.Struct("!dfB")
 
-    if login_result:
-        return jsonify({"message": f"User '{username}' logged in successfully"}), 200
-    else:
-        return jsonify({"error": "Invalid username or password"}), 401
+# Telemetry rate limits, in messages per second
+DEFAULT_PUSH_RATE = 10
+MAX_PUSH_RATE = 30
 
-def login_user(username, password):
-    # Add your user authentication logic here
-    return username == "admin" and password == "password"
+# A client whose unsent data exceeds CLIENT_BUFFER_LIMIT bytes skips updates
+# until it catches up; one that cannot take any data for SEND_TIMEOUT seconds
+# is disconnected
+CLIENT_BUFFER_LIMIT = 4096
+SEND_TIMEOUT = 5.0
 
-def bluetooth_server():
-    server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-    port = 1
-    server_sock.bind(("", port))
-    server_sock.listen(1)
-    client_sock, address = server_sock.accept()
-    print("Accepted connection from ", address)
+RFCOMM_CHANNEL = 1
+TCP_PORT = 5001
+
+
+class RfcommTransport:
+    """Accept phones over Bluetooth RFCOMM (Linux)."""
+
+    def __init__(self, channel=RFCOMM_CHANNEL):
+        self.channel = channel
+
+    async def start_server(self, client_connected):
+        """Listen for clients, calling client_connected(reader, writer) for each."""
+        server_socket = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+        server_socket.bind((socket.BDADDR_ANY, self.channel))
+        server_socket.listen()
+        server_socket.setblocking(False)
+
+        return await asyncio.start_server(client_connected, sock=server_socket)
+
+
+class TcpTransport:
+    """Accept clients over TCP, a stand-in for RFCOMM during development and testing."""
+
+    def __init__(self, host="127.0.0.1", port=TCP_PORT):
+        self.host = host
+        self.port = port
+
+    async def start_server(self, client_connected):
+        """Listen for clients, calling client_connected(reader, writer) for each."""
+        return await asyncio.start_server(client_connected, self.host, self.port)
+
+
+class UnixTransport:
+    """Accept clients on a Unix domain socket, a stand-in for RFCOMM during testing."""
+
+    def __init__(self, path="telemetry.sock"):
+        self.path = path
+
+    async def start_server(self, client_connected):
+        """Listen for clients, calling client_connected(reader, writer) for each."""
+        return await asyncio.start_unix_server(client_connected, self.path)
+
+
+TRANSPORTS = {
+    "rfcomm": RfcommTransport,
+    "tcp": TcpTransport,
+    "unix": UnixTransport,
+}
+
+
+def create_transport(name, **options):
+    """Create a transport by name."""
+    return TRANSPORTS[name](**options)
+
+
+def encode_message(message_type, payload=b""):
+    """Return a framed message."""
+    return HEADER.pack(message_type, len(payload)) + payload
+
+
+async def read_message(reader):
+    """Read one framed message and return (message_type, payload)."""
+    (message_type, length) = HEADER.unpack(await reader.readexactly(HEADER.size))
+
+    if length > MAX_PAYLOAD:
+        raise ValueError(f"Message of {length} bytes exceeds the {MAX_PAYLOAD} byte limit")
+
+    return (message_type, await reader.readexactly(length))
+
+
+class Client:
+    """Connection state of one phone."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.name = writer.get_extra_info("peername")
+        self.handler = asyncio.current_task()
+
+        self.username = None
+        self.push_interval = None
+        self.updated = asyncio.Event()
+        self.pusher = None
+        self.skipped_updates = 0
+
+
+class TelemetryServer:
+    """Serve many phone clients at once: login, commands and live EAR and alarm state.
+
+    The event loop runs on its own thread. Detection code calls publish() from
+    any thread; every subscriber is then sent only the newest state, at no more
+    than its requested rate, so a slow client misses intermediate updates
+    instead of holding up the others.
+    """
+
+    def __init__(self, transport, alarm_controller=None):
+        self.transport = transport
+        self.alarm_controller = alarm_controller
+
+        self.clients = set()
+        self.latest = None
+        self.notify_pending = False
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.ready = Event()
+
+    def start(self):
+        """Start serving on a background thread and wait until it is listening."""
+        self.thread = Thread(target=self.run, name="telemetry-server", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def run(self):
+        """Run the event loop until stop() is called."""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
 
-    while True:
         try:
-            data = client_sock.recv(1024)
-            if len(data) == 0:
-                break
-            print("received [%s]" % data)
+            self.server = self.loop.run_until_complete(self.transport.start_server(self.handle_client))
+
+        except OSError:
+            logging.exception("Telemetry server could not start")
+            self.ready.set()
+            self.loop.close()
+            self.loop = None
+            return
+
+        self.ready.set()
+        self.loop.run_forever()
+
+        self.server.close()
+
+        # Aborting a connection ends its handler, which cancels its push task
+        handlers = [client.handler for client in self.clients]
+
+        for client in list(self.clients):
+            client.writer.transport.abort()
+
+        self.loop.run_until_complete(asyncio.gather(*handlers, return_exceptions=True))
+        self.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self.loop), return_exceptions=True))
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def stop(self, timeout=5.0):
+        """Disconnect every client and stop the event loop."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def publish(self, ear_value, state):
+        """Record the latest EAR (None when no face) and alarm state; safe from any thread."""
+        self.latest = TELEMETRY_RECORD.pack(
+            time.time(),
+            math.nan if ear_value is None else ear_value,
+            alarm.STATE_CODES[state],
+        )
 
-            # Parse data and send to Flask
-            with app.test_request_context('/login', method='POST', json={"username": "admin", "password": "password"}):
-                response = login()
-                client_sock.send(response.get_data())
-        except IOError:
-            break
+        # Wake the loop at most once per iteration however often we publish
+        if self.loop is not None and not self.notify_pending:
+            self.notify_pending = True
+
+            try:
+                self.loop.call_soon_threadsafe(self.notify_subscribers)
+
+            except RuntimeError:
+                # The loop has been closed
+                pass
+
+    def notify_subscribers(self):
+        """Tell every subscriber's push task that a new state is available."""
+        self.notify_pending = False
+
+        for client in self.clients:
+            if client.push_interval is not None:
+                client.updated.set()
+
+    async def handle_client(self, reader, writer):
+        """Serve one client's requests until it disconnects."""
+        client = Client(reader, writer)
+        self.clients.add(client)
+        logging.info(f"Telemetry client {client.name} connected")
+
+        try:
+            while True:
+                (message_type, payload) = await read_message(reader)
+                await self.handle_message(client, message_type, payload)
+
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            pass
+
+        except ValueError as e:
+            logging.warning(f"Telemetry client {client.name} sent a bad message: {e}")
+
+        finally:
+            self.clients.discard(client)
+
+            if client.pusher is not None:
+                client.pusher.cancel()
+
+            writer.close()
+            logging.info(f"Telemetry client {client.name} disconnected")
+
+    async def handle_message(self, client, message_type, payload):
+        """Answer one request."""
+        if message_type == PING:
+            await self.reply(client, True, "pong")
+
+        elif message_type == LOGIN:
+            (username, _, password) = payload.decode("utf-8", "replace").partition("\0")
+
+            if not username or not password:
+                await self.reply(client, False, "Username and password are required")
+                return
+
+            # Password checks block on the bcrypt worker pool
+            (login_success, _) = await asyncio.get_running_loop().run_in_executor(
+                None, database.login_user, username, password)
+
+            if login_success:
+                client.username = username
+                driver_session.log_in(username)
+                await self.reply(client, True, "Logged in")
+
+            else:
+                await self.reply(client, False, "Invalid username or password")
+
+        elif client.username is None:
+            await self.reply(client, False, "Not logged in")
+
+        elif message_type == LOGOUT:
+            self.unsubscribe(client)
+            client.username = None
+            driver_session.log_out()
+            await self.reply(client, True, "Logged out")
+
+        elif message_type == SUBSCRIBE:
+            rate = payload[0] if payload and payload[0] else DEFAULT_PUSH_RATE
+            client.push_interval = 1.0 / min(rate, MAX_PUSH_RATE)
+
+            if client.pusher is None:
+                client.pusher = asyncio.create_task(self.push_telemetry(client))
+
+            await self.reply(client, True, f"Subscribed at {min(rate, MAX_PUSH_RATE)} per second")
+
+        elif message_type == UNSUBSCRIBE:
+            self.unsubscribe(client)
+            await self.reply(client, True, "Unsubscribed")
+
+        elif message_type == ACKNOWLEDGE:
+            if self.alarm_controller is not None:
+                self.alarm_controller.acknowledge()
+
+            await self.reply(client, True, "Alarm acknowledged")
+
+        else:
+            await self.reply(client, False, f"Unknown message type {message_type}")
+
+    def unsubscribe(self, client):
+        """Stop pushing telemetry to a client."""
+        client.push_interval = None
+
+        if client.pusher is not None:
+            client.pusher.cancel()
+            client.pusher = None
+
+    async def reply(self, client, success, message):
+        """Send a RESULT message and wait for the client to accept it."""
+        client.writer.write(encode_message(RESULT, bytes((0 if success else 1,)) + message.encode("utf-8")))
+        await asyncio.wait_for(client.writer.drain(), SEND_TIMEOUT)
+
+    async def push_telemetry(self, client):
+        """Send a subscriber the newest state whenever it changes, at most once per interval."""
+        transport = client.writer.transport
+
+        try:
+            while True:
+                await client.updated.wait()
+                client.updated.clear()
+
+                # Skip this update while the client is still behind; the next
+                # one it receives is the newest state anyway
+                if transport.get_write_buffer_size() > CLIENT_BUFFER_LIMIT:
+                    client.skipped_updates += 1
+
+                else:
+                    client.writer.write(encode_message(TELEMETRY, self.latest))
+
+                await asyncio.wait_for(client.writer.drain(), SEND_TIMEOUT)
+                await asyncio.sleep(client.push_interval)
+
+        except asyncio.TimeoutError:
+            logging.warning(f"Telemetry client {client.name} stopped reading, disconnecting")
+            transport.abort()
+
+        except ConnectionError:
+            pass
 
-    client_sock.close()
-    server_sock.close()
 
 if __name__ == "__main__":
-    bluetooth_server()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    # Fork the password workers while this is still the only thread
+    passwords.start()
+    database.initialize_tables()
+
+    telemetry_server = TelemetryServer(create_transport("rfcomm")).start()
+
+    try:
+        telemetry_server.thread.join()
+
+    except KeyboardInterrupt:
+        telemetry_server.stop()
+
+    finally:
+        passwords.stop()
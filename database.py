@@ -1,20 +1,141 @@
-from datetime import datetime
+from queue import LifoQueue, Empty, Full
+from threading import local, Lock
+import passwords
 import sqlite3
-import bcrypt
+import time
 
 DATABASE_NAME = "driver_drowsiness_detection.db"
 
+# WAL lets the event writer commit without blocking readers, and NORMAL only
+# fsyncs at checkpoints instead of on every commit (use FULL for durability).
+JOURNAL_MODE = "WAL"
+SYNCHRONOUS = "NORMAL"
+
+# Number of compiled statements each connection keeps ready for reuse
+STATEMENT_CACHE_SIZE = 256
+
+# Bumped whenever a stored format changes; see migrate_drowsiness_events()
+EVENTS_SCHEMA_VERSION = 1
+
+# Upper bound used when a time-range query has no end
+END_OF_TIME = 2 ** 62
+
+# Raw events rolled up, or pruned, per transaction; small transactions keep
+# the write lock free for the live event writer most of the time
+ROLLUP_BATCH_SIZE = 5000
+PRUNE_BATCH_SIZE = 500
+
+# Default and largest number of events returned by one get_drowsiness_events() page
+EVENT_PAGE_SIZE = 100
+MAX_EVENT_PAGE_SIZE = 1000
+
+thread_connections = local()
+
+# Connections returned by short-lived threads (one per API request), kept open
+# so the next thread skips connecting and configuring
+CONNECTION_POOL_SIZE = 8
+idle_connections = LifoQueue(maxsize=CONNECTION_POOL_SIZE)
+
+# username -> id, shared by all threads; only successful lookups are cached
+user_id_cache = {}
+user_id_cache_lock = Lock()
+
+def configure_connection(connection):
+    """Apply the journal mode and synchronous settings to a connection."""
+
+    connection.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    connection.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    return connection
+
+def get_connection():
+    """Return this thread's database connection, taking an idle one or opening one on first use."""
+
+    connection = getattr(thread_connections, "connection", None)
+
+    if connection is None:
+        try:
+            connection = idle_connections.get_nowait()
+
+        except Empty:
+            # Pooled connections move between threads, one thread at a time
+            connection = sqlite3.connect(DATABASE_NAME, cached_statements=STATEMENT_CACHE_SIZE,
+                                         check_same_thread=False)
+            configure_connection(connection)
+
+        thread_connections.connection = connection
+
+    return connection
+
+def return_connection():
+    """Hand this thread's connection to the idle pool, closing it if the pool is full."""
+
+    connection = getattr(thread_connections, "connection", None)
+
+    if connection is None:
+        return
+
+    thread_connections.connection = None
+    release_connection(connection)
+
+    try:
+        idle_connections.put_nowait(connection)
+
+    except Full:
+        connection.close()
+
+def close_connection():
+    """Close this thread's database connection, if it has one."""
+
+    connection = getattr(thread_connections, "connection", None)
+
+    if connection is not None:
+        connection.close()
+        thread_connections.connection = None
+
+def release_connection(connection):
+    """Roll back anything a failed call left uncommitted so the connection can be reused."""
+
+    if connection.in_transaction:
+        connection.rollback()
+
+def get_user_id(cursor, username):
+    """Return the id of a username, or None if it does not exist."""
+
+    user_id = user_id_cache.get(username)
+
+    if user_id is None:
+        cursor.execute("""
+            SELECT id FROM users WHERE username = ?
+        """, (username,))
+        result = cursor.fetchone()
+
+        if result:
+            user_id = result[0]
+
+            with user_id_cache_lock:
+                user_id_cache[username] = user_id
+
+    return user_id
+
+def invalidate_user_id(user_id):
+    """Drop every cached username that maps to a user id."""
+
+    with user_id_cache_lock:
+        for username in [name for (name, cached_id) in user_id_cache.items() if cached_id == user_id]:
+            del user_id_cache[username]
+
 def initialize_tables():
     """Initialize the database tables"""
 
     initialize_users_table()
     initialize_drowsiness_events_table()
+    initialize_drowsiness_rollup_tables()
     initialize_favorite_contacts_table()
 
 def initialize_users_table():
     """Initialize the SQLite database for storing system users."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute("""
@@ -28,7 +149,6 @@ def initialize_users_table():
     """)
 
     connection.commit()
-    connection.close()
 
 def register_user(username, password, fullname):
     """Register a new user with a username, password (plain text), and fullname."""
@@ -38,13 +158,13 @@ def register_user(username, password, fullname):
 
     hashed_password = hash_password(password)
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
         cursor.execute("""
             INSERT INTO users (username, password, fullname, picture)
-            VALUES (?, ?, ?, '')
+            VALUES (?, ?, ?, NULL)
         """, (username, hashed_password, fullname))
 
         connection.commit()
@@ -60,12 +180,12 @@ def register_user(username, password, fullname):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
 
 def login_user(username, password):
     """Login a user by checking the username and password."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
@@ -74,7 +194,7 @@ def login_user(username, password):
         """, (username,))
         result = cursor.fetchone()
 
-        if result and bcrypt.checkpw(password.encode("utf-8"), result[0].encode("utf-8")):
+        if result and passwords.check_password(password, result[0]):
             return True, "Login successful."
         else:
             return False, "Invalid username or password."
@@ -86,19 +206,17 @@ def login_user(username, password):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
 
 def hash_password(password):
-    """Hash the password using bcrypt."""
-    if isinstance(password, str):
-        password = password.encode('utf-8')  # Only encode if it's a string
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password, salt).decode('utf-8')
+    """Hash the password using bcrypt, in the password worker pool."""
+
+    return passwords.hash_password(password)
 
 def update_profile(user_id, username=None, password=None, fullname=None, picture=None):
     """Update user profile information."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
@@ -136,6 +254,10 @@ def update_profile(user_id, username=None, password=None, fullname=None, picture
             return False, "User not found or no changes made."
 
         connection.commit()
+
+        if username:
+            invalidate_user_id(user_id)
+
         return True, "Profile updated successfully."
 
     except sqlite3.IntegrityError:
@@ -148,18 +270,19 @@ def update_profile(user_id, username=None, password=None, fullname=None, picture
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
 
 def initialize_drowsiness_events_table():
     """Initialize the SQLite database for storing drowsiness events."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
+    # Timestamps are integer Unix epoch seconds (UTC)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS drowsiness_events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TIMESTAMP NOT NULL,
+            timestamp INTEGER NOT NULL,
             ear_value REAL NOT NULL,
             user_id INTEGER NOT NULL,
 
@@ -167,30 +290,47 @@ def initialize_drowsiness_events_table():
         )
     """)
 
+    migrate_drowsiness_events(cursor)
+
+    # Serves every per-driver time-range query; SQLite appends the rowid to the
+    # index, so (timestamp, id) keyset pages are read in index order as well
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS drowsiness_events_user_timestamp
+        ON drowsiness_events (user_id, timestamp)
+    """)
+
     connection.commit()
-    connection.close()
+
+def migrate_drowsiness_events(cursor):
+    """Convert events stored with text timestamps to epoch seconds, once per database."""
+
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+
+    if version < EVENTS_SCHEMA_VERSION:
+        # Text timestamps were written in local time
+        cursor.execute("""
+            UPDATE drowsiness_events
+            SET timestamp = CAST(strftime('%s', timestamp, 'utc') AS INTEGER)
+            WHERE typeof(timestamp) = 'text'
+        """)
+        cursor.execute(f"PRAGMA user_version = {EVENTS_SCHEMA_VERSION}")
 
 def insert_drowsiness_event(ear_value, username):
     """Insert a drowsiness event into the SQLite database."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
         # Fetch the user_id for the given username
-        cursor.execute("""
-            SELECT id FROM users WHERE username = ?
-        """, (username,))
-        result = cursor.fetchone()
-
-        if result:
-            user_id = result[0]
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        user_id = get_user_id(cursor, username)
 
+        if user_id is not None:
             cursor.execute("""
                 INSERT INTO drowsiness_events (timestamp, ear_value, user_id)
                 VALUES (?, ?, ?)
-            """, (timestamp, ear_value, user_id))
+            """, (int(time.time()), ear_value, user_id))
 
             connection.commit()
             return True, "Drowsiness event inserted successfully."
@@ -205,12 +345,286 @@ def insert_drowsiness_event(ear_value, username):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
+
+def insert_drowsiness_events(events):
+    """Insert a batch of (timestamp, ear_value, username) drowsiness events in one transaction."""
+
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    try:
+        # Resolve every distinct username once per batch
+        user_ids = {}
+        for username in {username for (_, _, username) in events}:
+            user_id = get_user_id(cursor, username)
+
+            if user_id is not None:
+                user_ids[username] = user_id
+
+        rows = [
+            (int(timestamp), ear_value, user_ids[username])
+            for (timestamp, ear_value, username) in events
+            if username in user_ids
+        ]
+
+        cursor.executemany("""
+            INSERT INTO drowsiness_events (timestamp, ear_value, user_id)
+            VALUES (?, ?, ?)
+        """, rows)
+
+        connection.commit()
+        return True, f"{len(rows)} drowsiness events inserted successfully."
+
+    except sqlite3.Error as e:
+        return False, f"Database error: {e}"
+
+    except Exception as e:
+        return False, f"Unexpected error: {e}"
+
+    finally:
+        release_connection(connection)
+
+def get_drowsiness_events(username, start=None, end=None, after=None, limit=EVENT_PAGE_SIZE):
+    """Get one page of a user's drowsiness events in [start, end), oldest first.
+
+    Pass the (timestamp, id) of the last event of a page as `after` to get the
+    next one; each page is a single index range scan however deep it is.
+    """
+
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    try:
+        user_id = get_user_id(cursor, username)
+
+        if user_id is None:
+            return False, "User not found."
+
+        start = 0 if start is None else start
+        end = END_OF_TIME if end is None else end
+        (after_timestamp, after_id) = (start, 0) if after is None else after
+
+        cursor.execute("""
+            SELECT id, timestamp, ear_value FROM drowsiness_events
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+              AND (timestamp > ? OR id > ?)
+            ORDER BY timestamp, id
+            LIMIT ?
+        """, (user_id, max(start, after_timestamp), end, after_timestamp, after_id,
+              min(max(limit, 1), MAX_EVENT_PAGE_SIZE)))
+
+        return True, cursor.fetchall()
+
+    except sqlite3.Error as e:
+        return False, f"Database error: {e}"
+
+    except Exception as e:
+        return False, f"Unexpected error: {e}"
+
+    finally:
+        release_connection(connection)
+
+def get_hourly_drowsiness_stats(username, start=None, end=None):
+    """Get (hour, event count, min EAR, mean EAR) per hour of a user's events in [start, end).
+
+    Events already rolled up are read from the per-minute aggregates, so hours
+    whose raw events have been pruned are still reported; only the events
+    newer than the rollup's high-water mark come from the raw table. Rolled-up
+    events are matched against start and end by their whole minute.
+    """
+
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    try:
+        user_id = get_user_id(cursor, username)
+
+        if user_id is None:
+            return False, "User not found."
+
+        start = 0 if start is None else start
+        end = END_OF_TIME if end is None else end
+
+        # The mark is read in the same statement, so each event is counted
+        # exactly once even while a rollup commits
+        cursor.execute("""
+            SELECT hour, SUM(event_count), MIN(min_ear), SUM(ear_sum) / SUM(event_count)
+            FROM (
+                SELECT minute / 3600 * 3600 AS hour, event_count, min_ear, ear_sum
+                FROM drowsiness_minutes
+                WHERE user_id = ? AND minute >= ? AND minute < ?
+
+                UNION ALL
+
+                SELECT timestamp / 3600 * 3600, 1, ear_value, ear_value
+                FROM drowsiness_events
+                WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+                AND id > (
+                    SELECT COALESCE(MAX(last_event_id), 0) FROM rollup_state WHERE name = 'drowsiness_events'
+                )
+            )
+            GROUP BY hour
+            ORDER BY hour
+        """, (user_id, start, end) * 2)
+
+        return True, cursor.fetchall()
+
+    except sqlite3.Error as e:
+        return False, f"Database error: {e}"
+
+    except Exception as e:
+        return False, f"Unexpected error: {e}"
+
+    finally:
+        release_connection(connection)
+
+def initialize_drowsiness_rollup_tables():
+    """Initialize the per-minute and per-day drowsiness event aggregate tables."""
+
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    # Buckets are epoch seconds at the start of the minute or (UTC) day; the
+    # EAR sum rather than its mean is stored so buckets can be merged
+    for (table, bucket) in (("drowsiness_minutes", "minute"), ("drowsiness_days", "day")):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                {bucket} INTEGER NOT NULL,
+                event_count INTEGER NOT NULL,
+                min_ear REAL NOT NULL,
+                ear_sum REAL NOT NULL,
+
+                PRIMARY KEY (user_id, {bucket}),
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            ) WITHOUT ROWID
+        """)
+
+    # Id of the last raw event included in the aggregates
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            last_event_id INTEGER NOT NULL
+        )
+    """)
+
+    connection.commit()
+
+def get_rollup_mark(cursor):
+    """Return the id of the last raw event already rolled up."""
+
+    cursor.execute("""
+        SELECT last_event_id FROM rollup_state WHERE name = 'drowsiness_events'
+    """)
+    result = cursor.fetchone()
+
+    return result[0] if result else 0
+
+def rollup_drowsiness_events(batch_size=ROLLUP_BATCH_SIZE):
+    """Add raw events newer than the high-water mark to the per-minute and per-day aggregates."""
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    rolled_up = 0
+
+    try:
+        while True:
+            last_event_id = get_rollup_mark(cursor)
+
+            cursor.execute("""
+                SELECT MAX(id), COUNT(*) FROM (
+                    SELECT id FROM drowsiness_events WHERE id > ? ORDER BY id LIMIT ?
+                )
+            """, (last_event_id, batch_size))
+            (batch_end, batch_count) = cursor.fetchone()
+
+            if not batch_count:
+                return True, f"{rolled_up} drowsiness events rolled up."
+
+            # "WHERE true" keeps SQLite from parsing ON CONFLICT as a join constraint
+            for (table, bucket, seconds) in (("drowsiness_minutes", "minute", 60),
+                                             ("drowsiness_days", "day", 86400)):
+                cursor.execute(f"""
+                    INSERT INTO {table} (user_id, {bucket}, event_count, min_ear, ear_sum)
+                    SELECT user_id, timestamp / {seconds} * {seconds}, COUNT(*), MIN(ear_value), SUM(ear_value)
+                    FROM drowsiness_events
+                    WHERE id > ? AND id <= ? AND true
+                    GROUP BY 1, 2
+                    ON CONFLICT (user_id, {bucket}) DO UPDATE SET
+                        event_count = event_count + excluded.event_count,
+                        min_ear = MIN(min_ear, excluded.min_ear),
+                        ear_sum = ear_sum + excluded.ear_sum
+                """, (last_event_id, batch_end))
+
+            cursor.execute("""
+                INSERT INTO rollup_state (name, last_event_id) VALUES ('drowsiness_events', ?)
+                ON CONFLICT (name) DO UPDATE SET last_event_id = excluded.last_event_id
+            """, (batch_end,))
+
+            connection.commit()
+            rolled_up += batch_count
+
+    except sqlite3.Error as e:
+        return False, f"Database error: {e}"
+
+    except Exception as e:
+        return False, f"Unexpected error: {e}"
+
+    finally:
+        release_connection(connection)
+
+def prune_drowsiness_events(retention_seconds, batch_size=PRUNE_BATCH_SIZE):
+    """Delete rolled-up raw events older than the retention window, a small batch per transaction."""
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    pruned = 0
+
+    try:
+        cutoff = int(time.time() - retention_seconds)
+
+        # Only rows already in the aggregates may go
+        last_event_id = get_rollup_mark(cursor)
+
+        cursor.execute("""
+            SELECT id FROM users
+        """)
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+        # Per user, so each batch is found with the (user_id, timestamp) index
+        for user_id in user_ids:
+            while True:
+                cursor.execute("""
+                    DELETE FROM drowsiness_events WHERE id IN (
+                        SELECT id FROM drowsiness_events
+                        WHERE user_id = ? AND timestamp < ? AND id <= ?
+                        LIMIT ?
+                    )
+                """, (user_id, cutoff, last_event_id, batch_size))
+
+                deleted = cursor.rowcount
+                connection.commit()
+                pruned += deleted
+
+                if deleted < batch_size:
+                    break
+
+        return True, f"{pruned} drowsiness events pruned."
+
+    except sqlite3.Error as e:
+        return False, f"Database error: {e}"
+
+    except Exception as e:
+        return False, f"Unexpected error: {e}"
+
+    finally:
+        release_connection(connection)
 
 def initialize_favorite_contacts_table():
     """Initialize the SQLite database for storing favorite contacts."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute("""
@@ -225,23 +639,18 @@ def initialize_favorite_contacts_table():
     """)
 
     connection.commit()
-    connection.close()
 
 def add_contact(username, country_code, national_number):
     """Add a new contact for the user."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
         # Fetch the user_id for the given username
-        cursor.execute("""
-            SELECT id FROM users WHERE username = ?
-        """, (username,))
-        result = cursor.fetchone()
+        user_id = get_user_id(cursor, username)
 
-        if result:
-            user_id = result[0]
+        if user_id is not None:
 
             # Check the current number of contacts for this user
             cursor.execute("""
@@ -270,23 +679,19 @@ def add_contact(username, country_code, national_number):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
 
 def get_contacts(username):
     """Get all contacts for the user."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
         # Fetch the user_id for the given username
-        cursor.execute("""
-            SELECT id FROM users WHERE username = ?
-        """, (username,))
-        result = cursor.fetchone()
+        user_id = get_user_id(cursor, username)
 
-        if result:
-            user_id = result[0]
+        if user_id is not None:
 
             cursor.execute("""
                 SELECT id, country_code, national_number FROM favorite_contacts WHERE user_id = ?
@@ -305,12 +710,12 @@ def get_contacts(username):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
 
 def update_contact(contact_id, country_code, national_number):
     """Update an existing contact."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
@@ -333,12 +738,12 @@ def update_contact(contact_id, country_code, national_number):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
+        release_connection(connection)
 
 def delete_contact(contact_id):
     """Delete a contact."""
 
-    connection = sqlite3.connect(DATABASE_NAME)
+    connection = get_connection()
     cursor = connection.cursor()
 
     try:
@@ -359,4 +764,4 @@ def delete_contact(contact_id):
         return False, f"Unexpected error: {e}"
 
     finally:
-        connection.close()
\ No newline at end of file
+        release_connection(connection)
\ No newline at end of file
@@ -0,0 +1,56 @@
+from threading import Lock
+import logging
+
+# Username of the logged-in driver, or None. It is only ever rebound as a whole,
+# so reading it is a single atomic lookup that needs no lock.
+current_driver = None
+
+subscribers = []
+lock = Lock()
+
+
+def get_current_driver():
+    """Return the username of the logged-in driver, or None."""
+    return current_driver
+
+
+def log_in(username):
+    """Record a driver as logged in and notify subscribers."""
+    set_driver(username)
+
+
+def log_out():
+    """Record that no driver is logged in and notify subscribers."""
+    set_driver(None)
+
+
+def set_driver(username):
+    """Replace the current driver and call every subscriber if it changed."""
+    global current_driver
+
+    with lock:
+        if username == current_driver:
+            return
+
+        current_driver = username
+        callbacks = list(subscribers)
+
+    for callback in callbacks:
+        try:
+            callback(username)
+
+        except Exception:
+            logging.exception("Driver session subscriber failed")
+
+
+def subscribe(callback):
+    """Call callback(username) on every login and logout (username is None on logout)."""
+    with lock:
+        subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    """Stop calling a previously subscribed callback."""
+    with lock:
+        if callback in subscribers:
+            subscribers.remove(callback)
@@ -0,0 +1,240 @@
+import model
+import alarm
+
+# Window lengths, in seconds
+MEAN_EAR_SECONDS = 2.0
+PERCLOS_SECONDS = 60.0
+
+# Continuous eye closure that raises a warning or the sleep alarm
+WARNING_CLOSURE_SECONDS = 0.5
+ALARM_CLOSURE_SECONDS = 1.0
+
+# Fraction of the PERCLOS window spent with closed eyes that raises a warning,
+# once at least PERCLOS_MIN_COVERAGE of the window has been observed
+PERCLOS_WARNING = 0.15
+PERCLOS_MIN_COVERAGE = 0.5
+
+# Samples further apart than this (e.g. while no face is found) only count for
+# this long in the windows
+MAX_SAMPLE_GAP = 0.5
+
+# Closed samples up to this far apart extend one closure, so slow inference or
+# frames without a face cannot keep restarting it; only a longer gap, or an
+# open sample, ends it
+MAX_CLOSURE_GAP = 5.0
+
+# A closed sample after an open one only covers this much closed time, one
+# frame at the nominal camera rate, however long the gap before it: with
+# adaptive sampling the eyes were most likely open for the rest of that gap,
+# so skipped frames only delay the alarm and never lengthen a closure
+FRAME_INTERVAL = 1.0 / 30.0
+
+# Ring buffer size; enough for the longest window at 60 samples per second
+BUFFER_CAPACITY = 4096
+
+# Adaptive sampling: while the EAR is at least SPARSE_MARGIN above the threshold
+# (as a fraction of it) frames are processed only every MAX_SAMPLE_INTERVAL
+# seconds, the worst-case delay before a closing eye is first seen. Below
+# FULL_RATE_MARGIN, or once any sample is closed, every frame is processed.
+# MAX_SAMPLE_INTERVAL must stay below MAX_SAMPLE_GAP.
+MAX_SAMPLE_INTERVAL = 0.4
+FULL_RATE_MARGIN = 0.15
+SPARSE_MARGIN = 0.5
+
+
+class SlidingWindow:
+    """Time-weighted mean EAR and closed-eye fraction over the last few seconds.
+
+    Samples live in a fixed-size ring buffer and the running sums are updated as
+    samples enter and leave the window, so each update costs O(1) amortized.
+    Each sample is weighted by the time since the previous one, which keeps the
+    results independent of the frame rate.
+    """
+
+    def __init__(self, seconds, capacity=BUFFER_CAPACITY):
+        self.seconds = seconds
+        self.capacity = capacity
+
+        self.timestamps = [0.0] * capacity
+        self.durations = [0.0] * capacity
+        self.weighted_ears = [0.0] * capacity
+        self.closed_durations = [0.0] * capacity
+
+        self.head = 0
+        self.count = 0
+
+        self.total_duration = 0.0
+        self.total_weighted_ear = 0.0
+        self.total_closed = 0.0
+
+    def add(self, timestamp, duration, ear_value, closed_duration):
+        """Add a sample covering `duration` seconds up to `timestamp`, `closed_duration` of them closed."""
+        if self.count == self.capacity:
+            self.evict_oldest()
+
+        index = (self.head + self.count) % self.capacity
+        weighted_ear = ear_value * duration
+
+        self.timestamps[index] = timestamp
+        self.durations[index] = duration
+        self.weighted_ears[index] = weighted_ear
+        self.closed_durations[index] = closed_duration
+        self.count += 1
+
+        self.total_duration += duration
+        self.total_weighted_ear += weighted_ear
+        self.total_closed += closed_duration
+
+        window_start = timestamp - self.seconds
+
+        while self.count and self.timestamps[self.head] <= window_start:
+            self.evict_oldest()
+
+    def evict_oldest(self):
+        """Remove the oldest sample from the window and the running sums."""
+        index = self.head
+
+        self.total_duration -= self.durations[index]
+        self.total_weighted_ear -= self.weighted_ears[index]
+        self.total_closed -= self.closed_durations[index]
+
+        self.head = (index + 1) % self.capacity
+        self.count -= 1
+
+        # Reset the sums when empty so floating point drift cannot build up
+        if not self.count:
+            self.total_duration = self.total_weighted_ear = self.total_closed = 0.0
+
+    def mean_ear(self):
+        """Return the time-weighted mean EAR over the window, or None if it is empty."""
+        if self.total_duration <= 0.0:
+            return None
+
+        return self.total_weighted_ear / self.total_duration
+
+    def closed_fraction(self):
+        """Return the fraction of the window spent with closed eyes."""
+        if self.total_duration <= 0.0:
+            return 0.0
+
+        return min(max(self.total_closed / self.total_duration, 0.0), 1.0)
+
+
+class AdaptiveSampler:
+    """Decide which frames need the full detection pipeline based on the latest EAR."""
+
+    def __init__(self, ear_threshold=model.EAR_THRESHOLD, max_interval=MAX_SAMPLE_INTERVAL,
+                 full_rate_margin=FULL_RATE_MARGIN, sparse_margin=SPARSE_MARGIN):
+        self.ear_threshold = ear_threshold
+        self.max_interval = min(max_interval, MAX_SAMPLE_GAP)
+        self.full_rate_margin = full_rate_margin
+        self.sparse_margin = sparse_margin
+
+        self.interval = 0.0
+        self.last_sampled_at = None
+
+        self.sampled = 0
+        self.skipped = 0
+
+    def should_process(self, timestamp):
+        """Return True if the frame taken at `timestamp` should be processed."""
+        if self.last_sampled_at is not None and timestamp - self.last_sampled_at < self.interval:
+            self.skipped += 1
+            return False
+
+        self.last_sampled_at = timestamp
+        self.sampled += 1
+        return True
+
+    def record(self, ear_value, state=alarm.IDLE):
+        """Set the next sampling interval from a processed frame's EAR (None if no face)."""
+        if ear_value is None or state != alarm.IDLE:
+            self.interval = 0.0
+            return
+
+        margin = (ear_value - self.ear_threshold) / self.ear_threshold
+
+        # Scale linearly from full rate to the sparsest rate between the two margins
+        scale = (margin - self.full_rate_margin) / (self.sparse_margin - self.full_rate_margin)
+        self.interval = self.max_interval * min(max(scale, 0.0), 1.0)
+
+
+class DrowsinessEngine:
+    """Turn timestamped EAR samples into an alarm state using time-based windows."""
+
+    def __init__(self, ear_threshold=model.EAR_THRESHOLD, mean_ear_seconds=MEAN_EAR_SECONDS,
+                 perclos_seconds=PERCLOS_SECONDS, capacity=BUFFER_CAPACITY):
+        self.ear_threshold = ear_threshold
+
+        self.mean_window = SlidingWindow(mean_ear_seconds, capacity)
+        self.perclos_window = SlidingWindow(perclos_seconds, capacity)
+
+        self.last_timestamp = None
+        self.closure_started_at = None
+        self.closure_seconds = 0.0
+        self.last_blink_seconds = 0.0
+        self.state = alarm.IDLE
+
+    def update(self, timestamp, ear_value):
+        """Add an EAR sample taken at `timestamp` (seconds) and return the new alarm state."""
+        closed = ear_value < self.ear_threshold
+
+        if self.last_timestamp is None:
+            gap = 0.0
+
+        else:
+            gap = timestamp - self.last_timestamp
+
+        duration = min(max(gap, 0.0), MAX_SAMPLE_GAP)
+
+        # Only a very long gap means we cannot tell whether the eyes stayed closed
+        if gap > MAX_CLOSURE_GAP:
+            self.closure_started_at = None
+
+        if closed:
+            if self.closure_started_at is None:
+                closed_duration = min(duration, FRAME_INTERVAL)
+                self.closure_started_at = timestamp - closed_duration
+
+            else:
+                closed_duration = duration
+
+            self.closure_seconds = timestamp - self.closure_started_at
+
+        else:
+            if self.closure_started_at is not None:
+                self.last_blink_seconds = self.closure_seconds
+
+            self.closure_started_at = None
+            self.closure_seconds = 0.0
+            closed_duration = 0.0
+
+        self.mean_window.add(timestamp, duration, ear_value, closed_duration)
+        self.perclos_window.add(timestamp, duration, ear_value, closed_duration)
+        self.last_timestamp = timestamp
+
+        self.state = self.decide_state()
+        return self.state
+
+    def decide_state(self):
+        """Pick the alarm state from the current closure and PERCLOS."""
+        if self.closure_seconds >= ALARM_CLOSURE_SECONDS:
+            return alarm.ALARM
+
+        if self.closure_seconds >= WARNING_CLOSURE_SECONDS:
+            return alarm.WARNING
+
+        perclos_coverage = self.perclos_window.total_duration / self.perclos_window.seconds
+
+        if perclos_coverage >= PERCLOS_MIN_COVERAGE and self.perclos() >= PERCLOS_WARNING:
+            return alarm.WARNING
+
+        return alarm.IDLE
+
+    def mean_ear(self):
+        """Return the rolling mean EAR."""
+        return self.mean_window.mean_ear()
+
+    def perclos(self):
+        """Return PERCLOS: the fraction of the long window spent with closed eyes."""
+        return self.perclos_window.closed_fraction()
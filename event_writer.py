@@ -0,0 +1,98 @@
+from queue import Queue, Empty, Full
+from threading import Thread
+import logging
+import metrics
+import time
+import database
+
+# Flush when this many events are queued or the oldest one is this old
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 1.0
+
+# When the queue is full, new events are dropped (and counted) rather than
+# blocking the capture thread
+QUEUE_SIZE = 4096
+
+_STOP = object()
+
+event_queue = Queue(maxsize=QUEUE_SIZE)
+writer_thread = None
+dropped_events = 0
+
+
+def start():
+    """Start the background writer thread if it is not already running."""
+    global writer_thread
+
+    if writer_thread is None or not writer_thread.is_alive():
+        writer_thread = Thread(target=run_writer, name="event-writer", daemon=True)
+        writer_thread.start()
+
+
+def submit(ear_value, username):
+    """Queue a drowsiness event without waiting for the database."""
+    global dropped_events
+
+    try:
+        event_queue.put_nowait((time.time(), ear_value, username))
+        return True
+
+    except Full:
+        dropped_events += 1
+        metrics.EVENTS_DROPPED.inc()
+        return False
+
+
+def stop(timeout=5.0):
+    """Flush every queued event and stop the writer thread."""
+    global writer_thread
+
+    if writer_thread is None:
+        return
+
+    event_queue.put(_STOP)
+    writer_thread.join(timeout)
+    writer_thread = None
+
+    if dropped_events:
+        logging.warning(f"Event writer dropped {dropped_events} events (queue full)")
+
+
+def flush_batch(batch):
+    """Write a batch of queued events to the database."""
+    started_at = time.perf_counter()
+    success, message = database.insert_drowsiness_events(batch)
+    metrics.DB_WRITE_LATENCY.observe_since(started_at)
+
+    if not success:
+        logging.error(f"Event writer failed to flush {len(batch)} events: {message}")
+
+
+def run_writer():
+    """Drain the queue, flushing batches by size or age until stopped."""
+    batch = []
+    deadline = None
+
+    while True:
+        timeout = None if not batch else max(0.0, deadline - time.monotonic())
+
+        try:
+            event = event_queue.get(timeout=timeout)
+
+        except Empty:
+            event = None
+
+        if event is _STOP:
+            if batch:
+                flush_batch(batch)
+            database.close_connection()
+            return
+
+        if event is not None:
+            if not batch:
+                deadline = time.monotonic() + FLUSH_INTERVAL
+            batch.append(event)
+
+        if len(batch) >= BATCH_SIZE or (batch and time.monotonic() >= deadline):
+            flush_batch(batch)
+            batch = []
@@ -0,0 +1,283 @@
+from threading import Thread, Event
+from datetime import datetime
+from queue import Queue
+import numpy as np
+import logging
+import time
+import os
+import cv2
+
+# Seconds of video saved before and after each sleep alarm
+PRE_ALARM_SECONDS = 10.0
+POST_ALARM_SECONDS = 5.0
+
+# The ring buffer is allocated once, on the first frame, and never grows. In
+# "jpeg" storage each frame is compressed into a slot of 1/JPEG_SLOT_RATIO of
+# its raw size (frames that do not fit are skipped); "raw" keeps exact pixels
+# but holds far fewer seconds in the same memory.
+MEMORY_LIMIT = 64 * 1024 * 1024
+STORAGE = "jpeg"
+JPEG_QUALITY = 80
+JPEG_SLOT_RATIO = 8
+
+CLIP_DIRECTORY = "incidents"
+CLIP_FOURCC = "MJPG"
+
+# How often the dump thread checks for frames recorded after the alarm, and
+# how long it waits for one before giving the clip up as complete
+POLL_INTERVAL = 0.05
+FRAME_TIMEOUT = 2.0
+
+_STOP = object()
+
+
+class IncidentRecorder:
+    """Keep the last seconds of video in a fixed-size ring and save a clip around each alarm.
+
+    add() runs on the capture thread and only copies (or compresses) the frame
+    into the next preallocated slot. trigger() only queues the alarm time; a
+    background thread then reads the frames out of the ring as they arrive and
+    writes the clip. Every slot carries the sequence number of the frame in
+    it, so a frame overwritten while being read is detected and skipped.
+    """
+
+    def __init__(self, pre_seconds=PRE_ALARM_SECONDS, post_seconds=POST_ALARM_SECONDS,
+                 memory_limit=MEMORY_LIMIT, storage=STORAGE, directory=CLIP_DIRECTORY):
+        if storage not in ("jpeg", "raw"):
+            raise ValueError(f"Unknown incident storage {storage!r}")
+
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.memory_limit = memory_limit
+        self.storage = storage
+        self.directory = directory
+        self.encode_parameters = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+
+        # Allocated on the first frame, once its size is known
+        self.frame_shape = None
+        self.slots = None
+        self.lengths = None
+        self.timestamps = None
+        self.sequences = None
+        self.read_buffer = None
+
+        # Frames added so far; frame n lives in slot n % capacity
+        self.frame_count = 0
+        self.oversized_frames = 0
+
+        self.triggers = Queue()
+        self.dumping = Event()
+        self.thread = None
+
+    def start(self):
+        """Start the background dump thread."""
+        self.thread = Thread(target=self.run, name="incident-recorder", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Finish any clip being written and stop the dump thread."""
+        if self.thread is None:
+            return
+
+        self.triggers.put(_STOP)
+        self.thread.join(timeout)
+        self.thread = None
+
+        if self.oversized_frames:
+            logging.warning(f"Incident recorder skipped {self.oversized_frames} frames too large for their slot")
+
+    def allocate(self, frame):
+        """Size and allocate the ring for frames shaped like this one."""
+        self.frame_shape = frame.shape
+
+        if self.storage == "raw":
+            slot_shape = frame.shape
+
+        else:
+            slot_shape = (max(frame.nbytes // JPEG_SLOT_RATIO, 1),)
+
+        capacity = max(self.memory_limit // int(np.prod(slot_shape)), 2)
+
+        self.slots = np.empty((capacity,) + slot_shape, dtype=np.uint8)
+        self.lengths = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.sequences = np.full(capacity, -1, dtype=np.int64)
+        self.read_buffer = np.empty(slot_shape, dtype=np.uint8)
+
+        logging.info(f"Incident recorder holds {capacity} {self.storage} frames of {frame.shape}")
+
+    def add(self, frame, timestamp=None):
+        """Copy a captured frame into the next slot, overwriting the oldest one."""
+        if self.slots is None:
+            self.allocate(frame)
+
+        if frame.shape != self.frame_shape:
+            return
+
+        sequence = self.frame_count
+        slot = sequence % len(self.slots)
+
+        # Mark the slot as being written before touching it
+        self.sequences[slot] = -1
+
+        if self.storage == "raw":
+            np.copyto(self.slots[slot], frame)
+
+        else:
+            (success, encoded) = cv2.imencode(".jpg", frame, self.encode_parameters)
+
+            if not success or encoded.size > self.slots.shape[1]:
+                self.oversized_frames += 1
+                return
+
+            self.slots[slot, :encoded.size] = encoded.reshape(-1)
+            self.lengths[slot] = encoded.size
+
+        self.timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+        self.sequences[slot] = sequence
+        self.frame_count = sequence + 1
+
+    def recording(self, read_frame):
+        """Wrap a capture read function so every frame it returns is also added."""
+
+        def read_and_record():
+            (ret, frame) = read_frame()
+
+            if ret:
+                self.add(frame)
+
+            return (ret, frame)
+
+        return read_and_record
+
+    def trigger(self, timestamp):
+        """Ask for a clip around an alarm raised at a time.monotonic() reading; never blocks."""
+        if self.dumping.is_set():
+            logging.info("Incident clip already being saved, alarm not recorded separately")
+            return
+
+        self.dumping.set()
+        self.triggers.put(timestamp)
+
+    def read(self, sequence):
+        """Return (frame, timestamp) for a frame still in the ring, or (None, None) if overwritten."""
+        slot = sequence % len(self.slots)
+
+        if self.sequences[slot] != sequence:
+            return (None, None)
+
+        timestamp = self.timestamps[slot]
+
+        if self.storage == "raw":
+            np.copyto(self.read_buffer, self.slots[slot])
+            encoded = None
+
+        else:
+            length = self.lengths[slot]
+            np.copyto(self.read_buffer[:length], self.slots[slot, :length])
+            encoded = self.read_buffer[:length]
+
+        # Discard the copy if the capture thread reused the slot meanwhile
+        if self.sequences[slot] != sequence:
+            return (None, None)
+
+        if encoded is None:
+            return (self.read_buffer, timestamp)
+
+        return (cv2.imdecode(encoded, cv2.IMREAD_COLOR), timestamp)
+
+    def first_sequence_since(self, timestamp):
+        """Return the oldest frame still in the ring taken at or after a time."""
+        oldest = max(self.frame_count - len(self.slots), 0)
+        sequence = self.frame_count
+
+        while sequence > oldest:
+            slot = (sequence - 1) % len(self.slots)
+
+            if self.sequences[slot] == sequence - 1 and self.timestamps[slot] < timestamp:
+                break
+
+            sequence -= 1
+
+        return sequence
+
+    def estimate_fps(self, first_sequence):
+        """Estimate the capture rate from the frames recorded since first_sequence."""
+        last_sequence = self.frame_count - 1
+
+        if last_sequence > first_sequence:
+            first_at = self.timestamps[first_sequence % len(self.slots)]
+            last_at = self.timestamps[last_sequence % len(self.slots)]
+
+            if last_at > first_at:
+                return (last_sequence - first_sequence) / (last_at - first_at)
+
+        return 30.0
+
+    def run(self):
+        """Write a clip for each queued alarm until stopped."""
+        while True:
+            alarm_at = self.triggers.get()
+
+            if alarm_at is _STOP:
+                return
+
+            try:
+                if self.slots is not None:
+                    self.dump(alarm_at)
+
+            except Exception:
+                logging.exception("Failed to save incident clip")
+
+            finally:
+                self.dumping.clear()
+
+    def dump(self, alarm_at):
+        """Save the frames from pre_seconds before to post_seconds after an alarm."""
+        sequence = self.first_sequence_since(alarm_at - self.pre_seconds)
+        first_at = self.timestamps[sequence % len(self.slots)] if sequence < self.frame_count else alarm_at
+
+        # Only worth a warning once the ring has wrapped, not just after startup
+        if first_at > alarm_at - self.pre_seconds + 1.0 and self.frame_count > len(self.slots):
+            logging.warning(f"Incident ring only held {alarm_at - first_at:.1f} s before the alarm "
+                            f"(wanted {self.pre_seconds:.1f} s); raise MEMORY_LIMIT or use jpeg storage")
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"incident_{datetime.now().strftime('%Y%m%d_%H%M%S')}.avi")
+
+        (height, width) = self.frame_shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*CLIP_FOURCC), self.estimate_fps(sequence), (width, height))
+
+        written = 0
+        lost = 0
+        waiting_since = time.monotonic()
+
+        try:
+            while True:
+                # Wait for frames recorded after the alarm
+                if sequence >= self.frame_count:
+                    if time.monotonic() - waiting_since > FRAME_TIMEOUT:
+                        break
+
+                    time.sleep(POLL_INTERVAL)
+                    continue
+
+                waiting_since = time.monotonic()
+                (frame, timestamp) = self.read(sequence)
+                sequence += 1
+
+                if frame is None:
+                    lost += 1
+                    continue
+
+                if timestamp > alarm_at + self.post_seconds:
+                    break
+
+                writer.write(frame)
+                written += 1
+
+        finally:
+            writer.release()
+
+        logging.info(f"Saved incident clip {path} ({written} frames, {lost} lost)")
@@ -0,0 +1,123 @@
+from collections import deque
+from threading import Condition
+import json
+import math
+import time
+
+# Client-requested sample rates, in samples per second
+DEFAULT_RATE = 5.0
+MAX_RATE = 30.0
+
+# Discrete events kept for clients that fall behind; older ones are lost to them
+EVENT_BUFFER_SIZE = 256
+
+# A comment is sent after this many idle seconds so closed clients are noticed
+KEEPALIVE_SECONDS = 15.0
+
+# The detection loop only overwrites `latest` and, on a change of state,
+# appends to `events` and wakes the streams. Every stream reads the same
+# buffer at its own pace, so viewers add no per-frame work to the loop.
+
+# (sequence, timestamp, ear_value, is_drowsy, alarm_state), or None
+latest = None
+sample_sequence = 0
+
+# (sequence, event name, data) for drowsy and alarm state changes
+events = deque(maxlen=EVENT_BUFFER_SIZE)
+event_sequence = 0
+event_condition = Condition()
+
+last_drowsy = False
+last_alarm = None
+
+
+def publish(ear_value, is_drowsy, alarm_state):
+    """Record the latest sample (ear_value None when no face); called from the detection loop."""
+    global latest, sample_sequence, last_drowsy, last_alarm
+
+    timestamp = time.time()
+    sample_sequence += 1
+    latest = (sample_sequence, timestamp, ear_value, is_drowsy, alarm_state)
+
+    if is_drowsy != last_drowsy:
+        add_event("drowsy", {"timestamp": timestamp, "drowsy": is_drowsy, "ear": ear_value})
+        last_drowsy = is_drowsy
+
+    if alarm_state != last_alarm:
+        add_event("alarm", {"timestamp": timestamp, "from": last_alarm, "to": alarm_state})
+        last_alarm = alarm_state
+
+
+def add_event(name, data):
+    """Append a discrete event and wake every stream."""
+    global event_sequence
+
+    with event_condition:
+        event_sequence += 1
+        events.append((event_sequence, name, data))
+        event_condition.notify_all()
+
+
+def format_event(name, data, event_id=None):
+    """Return one Server-Sent Events message."""
+    lines = [f"event: {name}"]
+
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def stream(rate=DEFAULT_RATE):
+    """Yield Server-Sent Events: samples decimated to `rate` per second, plus every state change.
+
+    Each sample sent is the newest one, so a client that reads slowly (and
+    blocks this generator) skips the samples it missed instead of queueing them.
+    """
+    # NaN would slip through the clamp below and make the loop spin
+    if not math.isfinite(rate):
+        rate = DEFAULT_RATE
+
+    interval = 1.0 / min(max(rate, 0.1), MAX_RATE)
+
+    last_sample = sample_sequence
+    last_event = event_sequence
+    next_sample_at = time.monotonic()
+    last_sent_at = time.monotonic()
+
+    yield "retry: 2000\n\n"
+
+    while True:
+        with event_condition:
+            if event_sequence == last_event:
+                event_condition.wait(max(0.0, next_sample_at - time.monotonic()))
+
+            pending = [event for event in list(events) if event[0] > last_event]
+
+        for (sequence, name, data) in pending:
+            yield format_event(name, data, sequence)
+            last_event = sequence
+            last_sent_at = time.monotonic()
+
+        now = time.monotonic()
+
+        if now < next_sample_at:
+            continue
+
+        next_sample_at = max(next_sample_at + interval, now)
+        sample = latest
+
+        if sample is not None and sample[0] != last_sample:
+            (last_sample, timestamp, ear_value, is_drowsy, alarm_state) = sample
+            yield format_event("sample", {
+                "timestamp": timestamp,
+                "ear": ear_value,
+                "drowsy": is_drowsy,
+                "alarm": alarm_state,
+            })
+            last_sent_at = now
+
+        elif now - last_sent_at >= KEEPALIVE_SECONDS:
+            yield ": keepalive\n\n"
+            last_sent_at = now
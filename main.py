@@ -1,89 +1,313 @@
+# Must come first: it times the imports below for the startup report
+import startup
+startup.install()
+
+import drowsiness_engine
 import database
+import event_writer
+import rollup
+import live_stream
+import passwords
+import driver_session
 import logging
-import buzzer
+import alarm
+import metrics
+import numpy as np
 import model
+import argparse
+import math
+import preview
+import incident_recorder as incidents
+from telemetry_recorder import TelemetryRecorder
+import signal
+import time
 import cv2
-import api
+from pipeline import Pipeline, OUTPUT_QUEUE_SIZE
 from threading import Thread
-import winsound
 
-DROWSY_CONSECUTIVE_FRAMES = 5
-SLEEP_CONSECUTIVE_FRAMES = 10
 alarm_status = False
-drowsy_frames_counter = 0
+
+face_tracker = model.FaceTracker()
+engine = drowsiness_engine.DrowsinessEngine()
+
+# Detect on a small frame and landmark a native-resolution face crop instead of
+# running both on the 320x240 display frame
+MULTI_RESOLUTION = False
+multi_resolution = model.MultiResolutionProcessor(face_tracker=face_tracker)
+
+# Analyze frames sparsely while the eyes are clearly open
+ADAPTIVE_SAMPLING = True
+sampler = drowsiness_engine.AdaptiveSampler()
+
+# Pick "gpio" for the Raspberry Pi buzzer or "sound" for the host speaker;
+# None chooses by platform
+ALARM_BACKEND = None
+alarm_controller = None
+
+# Transport the phone telemetry server listens on ("rfcomm" on the Pi), or None to disable it
+TELEMETRY_TRANSPORT = None
+telemetry_server = None
+
+# Headless runs make no window or keyboard calls and stop on SIGINT or SIGTERM;
+# otherwise the main thread shows the newest result PREVIEW_FPS times a second
+HEADLESS = False
+PREVIEW_FPS = preview.PREVIEW_FPS
+preview_renderer = None
+first_result_handled = False
+
+# Keep the last seconds of camera video in memory and save a clip around every sleep alarm
+RECORD_INCIDENTS = True
+incident_recorder = None
+
+# Append a fixed-width binary record per frame to memory-mapped files in telemetry/
+RECORD_TELEMETRY = True
+telemetry_recorder = None
+
+# One buffer set for every frame that can still be in use at once: the one the
+# inference stage is preparing (or waiting to queue), those queued for the
+# output stage, the one it is handling, and the preview's newest and the one
+# it is copying
+frame_context = model.FrameContext(slots=1 + OUTPUT_QUEUE_SIZE + 1 + 2)
 
 logging.basicConfig(filename="drowsiness_history.log", level=logging.INFO)
 
 
-def main():
-    """Main function to start the drowsiness detection system."""
-    global drowsy_frames_counter
+def process_frame(frame, captured_at):
+    """Inference stage: find the face, compute its EAR and update the drowsiness state."""
+    global alarm_status
 
-    database.initialize_tables()
+    started_at = time.perf_counter()
+    resized_frame = frame_context.prepare(frame)
+    gray_frame = frame_context.gray
 
-    capture = cv2.VideoCapture(0)
-    (ret, frame) = capture.read()
+    result = {
+        "frame": resized_frame,
+        "face_landmarks": None,
+        "ear_value": None,
+        "is_drowsy": False,
+        "alarm": engine.state,
+    }
+
+    if ADAPTIVE_SAMPLING and not sampler.should_process(captured_at):
+        metrics.FRAMES_SKIPPED.inc()
+
+        if telemetry_recorder is not None:
+            telemetry_recorder.record(captured_at, math.nan, False, True, alarm.STATE_CODES[result["alarm"]],
+                                      0.0, 0.0, (time.perf_counter() - started_at) * 1000.0)
+
+        return result
+
+    detection_started_at = time.perf_counter()
+    (face_landmarks, ear_value, detected_at) = find_landmarks(frame, resized_frame, gray_frame)
+    landmarked_at = time.perf_counter()
+
+    if face_landmarks is not None:
+
+        is_drowsy = model.is_drowsy(ear_value)
+
+        metrics.FACES_FOUND.inc()
+        metrics.LAST_EAR.set(ear_value)
+
+        result["face_landmarks"] = face_landmarks
+        result["ear_value"] = ear_value
+        result["is_drowsy"] = is_drowsy
+
+        # Time-based windows, so skipped or dropped frames do not change alarm timing
+        previous_state = engine.state
+        result["alarm"] = engine.update(captured_at, ear_value)
+        alarm_status = result["alarm"] != alarm.IDLE
+
+        metrics.PERCLOS.set(engine.perclos())
+
+        # Only records the new state; the alarm thread does the sounding
+        alarm_controller.post(result["alarm"])
+
+        # Only queues the request; the recorder's thread writes the clip
+        if incident_recorder is not None and result["alarm"] == alarm.ALARM and previous_state != alarm.ALARM:
+            incident_recorder.trigger(captured_at)
+
+    sampler.record(result["ear_value"], result["alarm"])
+    live_stream.publish(result["ear_value"], result["is_drowsy"], result["alarm"])
+
+    if telemetry_server is not None:
+        telemetry_server.publish(result["ear_value"], result["alarm"])
+
+    if telemetry_recorder is not None:
+        telemetry_recorder.record(
+            captured_at,
+            math.nan if ear_value is None else ear_value,
+            face_landmarks is not None,
+            False,
+            alarm.STATE_CODES[result["alarm"]],
+            (detected_at - detection_started_at) * 1000.0,
+            (landmarked_at - detected_at) * 1000.0,
+            (time.perf_counter() - started_at) * 1000.0,
+        )
+
+    return result
+
+
+def find_landmarks(frame, resized_frame, gray_frame):
+    """Return the first face's landmarks (in display coordinates), its EAR and when detection ended.
 
-    while ret:
+    Landmarks and EAR are None without a face; the end is a time.perf_counter() reading.
+    """
 
-        resized_frame = model.resize_frame(frame)
-        face = model.detect_first_face(resized_frame)
+    if MULTI_RESOLUTION:
+        face = multi_resolution.detect(frame)
+        detected_at = time.perf_counter()
 
-        if face is not None:
+        if face is None:
+            return (None, None, detected_at)
 
-            face_landmarks = model.get_face_landmarks(resized_frame, face)
-            ear_value = model.calculate_average_ear(face_landmarks)
-            is_drowsy = model.is_drowsy(ear_value)
+        native_landmarks = multi_resolution.get_landmarks(frame, face)
 
-            if is_drowsy:
-                drowsy_frames_counter += 1
+        # (x, y) scales; the display frame need not share the camera's aspect ratio
+        display_scale = np.array([resized_frame.shape[1] / frame.shape[1], resized_frame.shape[0] / frame.shape[0]])
 
-                if drowsy_frames_counter >= SLEEP_CONSECUTIVE_FRAMES:
-                    alarm_status = True
+        return ((native_landmarks * display_scale).astype(np.int32), model.calculate_average_ear(native_landmarks),
+                detected_at)
 
-                    # When testing
-                    winsound.Beep(1000,1500)
+    face = face_tracker.detect(resized_frame, gray_frame)
+    detected_at = time.perf_counter()
 
-                    #for rasspberry pi use
-                    # buzzer.start_alarm(alarm_status)
+    if face is None:
+        return (None, None, detected_at)
 
-                elif drowsy_frames_counter >= DROWSY_CONSECUTIVE_FRAMES:
+    face_landmarks = model.get_face_landmarks(resized_frame, face, gray_frame)
+    return (face_landmarks, model.calculate_average_ear(face_landmarks), detected_at)
 
-                    alarm_status = True
-                    # When testing
-                    winsound.Beep(1000,500)
 
-                    #for rasspberry pi use
-                    # buzzer.start_alarm(alarm_status)
+def handle_result(result):
+    """Output stage: persist drowsy events and hand the result to the preview, if any."""
 
-                logged_user_result = api.get_login_status()
+    if result["is_drowsy"]:
+        username = driver_session.current_driver
 
-                if logged_user_result["logged_in"]:
-                    database.insert_drowsiness_event(ear_value, logged_user_result["username"])
+        if username is not None:
+            event_writer.submit(result["ear_value"], username)
 
-                else:
-                    print("Logged out")
+        else:
+            logging.debug("Drowsy frame while logged out")
 
-            else:
-                alarm_status = False
-                
-                drowsy_frames_counter = 0
+    if preview_renderer is not None:
+        preview_renderer.submit(result)
 
-            face_with_landmarks = model.draw_landmarks_on_face(resized_frame, face_landmarks)
-            cv2.imshow("Face Landmarks", face_with_landmarks)
+    if not first_result_handled:
+        report_startup()
 
-            print(f"EAR Value: {ear_value}")
 
-        cv2.imshow("Captured Frame", resized_frame)
-        (ret, frame) = capture.read()
+def on_driver_change(username):
+    """Log driver logins and logouts pushed by the session store."""
+    if username is None:
+        logging.info("Driver logged out")
 
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+    else:
+        logging.info(f"Driver {username} logged in")
 
 
+def report_startup():
+    """Log the startup timeline once the first frame has been processed."""
+    global first_result_handled
+
+    first_result_handled = True
+    startup.mark("first frame processed")
+    startup.log_report()
+
+
+def start_api_server():
+    """Import and serve the API (including /metrics) from this process."""
+    import api
+
+    api.run_server()
+
+
+def main():
+    """Main function to start the drowsiness detection system."""
+    global alarm_controller, telemetry_server, preview_renderer, incident_recorder, telemetry_recorder
+
+    parser = argparse.ArgumentParser(description="Detect driver drowsiness from the camera.")
+    parser.add_argument("--headless", action="store_true", default=HEADLESS,
+                        help="run without preview windows, e.g. in the vehicle")
+    parser.add_argument("--preview-fps", type=float, default=PREVIEW_FPS)
+    args = parser.parse_args()
+
+    # Fork the password workers while this is still the only thread
+    passwords.start()
+    database.initialize_tables()
+    event_writer.start()
+    rollup.start()
+    driver_session.subscribe(on_driver_change)
+    alarm_controller = alarm.AlarmController(alarm.create_backend(ALARM_BACKEND)).start()
+
+    if TELEMETRY_TRANSPORT is not None:
+        import bluetooth_server
+
+        transport = bluetooth_server.create_transport(TELEMETRY_TRANSPORT)
+        telemetry_server = bluetooth_server.TelemetryServer(transport, alarm_controller).start()
+
+    # Serve the API from this process so /metrics and /login see live state;
+    # Flask is imported on that thread, off the path to the first frame
+    Thread(target=start_api_server, name="api", daemon=True).start()
+
+    # Load the models while the camera opens
+    warm_up_thread = model.warm_up_in_background()
+
+    started_at = time.perf_counter()
+    capture = cv2.VideoCapture(0)
+    startup.record("open camera", started_at)
+
+    warm_up_thread.join()
+
+    read_frame = capture.read
+
+    # Frames enter the ring on the capture thread, off the detection path
+    if RECORD_INCIDENTS:
+        incident_recorder = incidents.IncidentRecorder().start()
+        read_frame = incident_recorder.recording(capture.read)
+
+    if RECORD_TELEMETRY:
+        telemetry_recorder = TelemetryRecorder()
+
+    detection_pipeline = Pipeline(read_frame, process_frame, handle_result)
+
+    def stop_on_signal(signum, _frame):
+        """Finish the pipeline cleanly instead of dying mid-write."""
+        logging.info(f"Received {signal.Signals(signum).name}, stopping")
+        detection_pipeline.stop()
+
+    signal.signal(signal.SIGINT, stop_on_signal)
+    signal.signal(signal.SIGTERM, stop_on_signal)
+
+    if args.headless:
+        detection_pipeline.run()
+
+    else:
+        preview_renderer = preview.PreviewRenderer(args.preview_fps, on_quit=detection_pipeline.stop,
+                                                   stop_event=detection_pipeline.stop_event)
+
+        # Every stage runs on a worker so the windows can be drawn from the main thread
+        detection_pipeline.start()
+        preview_renderer.run()
+        detection_pipeline.join()
+
     capture.release()
-    cv2.destroyAllWindows()
-    buzzer.clean_pins_up()
+    event_writer.stop()
+    rollup.stop()
+    detection_pipeline.log_stats()
+    logging.info(f"Face tracking stats: {face_tracker.stats()}")
+
+    if incident_recorder is not None:
+        incident_recorder.stop()
+
+    if telemetry_recorder is not None:
+        telemetry_recorder.close()
+    alarm_controller.stop()
+
+    if telemetry_server is not None:
+        telemetry_server.stop()
+
+    passwords.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
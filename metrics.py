@@ -0,0 +1,129 @@
+from bisect import bisect_left
+import time
+
+# Metrics are plain attribute updates with no locking: each one is written by a
+# single stage thread, and the cost of a scrape is paid only by the scraper.
+
+METRIC_PREFIX = "ddds_"
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+registry = []
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self, name, description):
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increase the counter."""
+        self.value += amount
+
+    def render(self):
+        """Return the counter in the Prometheus text format."""
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Gauge:
+    """A value that can go up and down, such as the latest EAR."""
+
+    def __init__(self, name, description):
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.value = 0.0
+
+    def set(self, value):
+        """Set the gauge's current value."""
+        self.value = value
+
+    def render(self):
+        """Return the gauge in the Prometheus text format."""
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Histogram:
+    """Counts of observations in fixed buckets, plus their sum and count."""
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.buckets = tuple(buckets)
+
+        # One slot per bucket plus the +Inf overflow slot
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record one observation."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def observe_since(self, started_at):
+        """Record the time elapsed since a time.perf_counter() reading."""
+        self.observe(time.perf_counter() - started_at)
+
+    def render(self):
+        """Return the histogram in the Prometheus text format (cumulative buckets)."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        counts = list(self.counts)
+        cumulative = 0
+
+        for (upper_bound, count) in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{upper_bound}"}} {cumulative}')
+
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {cumulative}")
+
+        return lines
+
+
+def register(metric):
+    """Add a metric to the set served by render()."""
+    registry.append(metric)
+    return metric
+
+
+def render():
+    """Return every registered metric in the Prometheus text exposition format."""
+    lines = []
+
+    for metric in registry:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+FRAMES_CAPTURED = register(Counter("frames_captured_total", "Frames read from the camera."))
+FRAMES_DROPPED = register(Counter("frames_dropped_total", "Captured frames replaced by a newer frame before inference."))
+FRAMES_SKIPPED = register(Counter("frames_skipped_total", "Frames not analyzed because the EAR was well above the threshold."))
+FACES_FOUND = register(Counter("faces_found_total", "Processed frames in which a face was found."))
+ALARMS_FIRED = register(Counter("alarms_fired_total", "Drowsiness warnings and sleep alarms started."))
+EVENTS_DROPPED = register(Counter("events_dropped_total", "Drowsiness events dropped because the write queue was full."))
+
+LAST_EAR = register(Gauge("last_ear", "Most recent eye aspect ratio."))
+PERCLOS = register(Gauge("perclos", "Fraction of the PERCLOS window spent with closed eyes."))
+
+DETECTION_LATENCY = register(Histogram("detection_latency_seconds", "Face detection or tracking time per frame."))
+LANDMARK_LATENCY = register(Histogram("landmark_latency_seconds", "Facial landmark prediction time per face."))
+DB_WRITE_LATENCY = register(Histogram("db_write_latency_seconds", "Time to write one batch of drowsiness events."))
+ALARM_ONSET_LATENCY = register(Histogram("alarm_onset_latency_seconds", "Time from an alarm being posted to its first tone."))
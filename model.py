@@ -1,18 +1,138 @@
 from imutils import face_utils
+from threading import Thread, Lock
 import numpy as np
+import startup
+import metrics
+import time
 import dlib
 import cv2
+import os
 
 # Constants
 EAR_THRESHOLD = 0.3
 
+# Tracking mode: re-run the full-frame detector every REDETECT_INTERVAL frames,
+# or sooner when the tracker's peak-to-sidelobe confidence drops below
+# TRACKING_MIN_CONFIDENCE. When tracking is lost, the last box grown by
+# SEARCH_MARGIN on each side is searched before falling back to the full frame.
+REDETECT_INTERVAL = 10
+TRACKING_MIN_CONFIDENCE = 7.0
+SEARCH_MARGIN = 0.5
+
+# Face detector backend (a DETECTOR_BACKENDS key). "hog" is dlib's detector with
+# HOG_UPSAMPLE upsampling passes, "haar" is OpenCV's bundled frontal-face cascade
+# (only registered when the OpenCV build has it), and "hog_downscaled" runs HOG
+# on the frame shrunk by DOWNSCALE_FACTOR (faster, but faces must then be at
+# least 80 / DOWNSCALE_FACTOR pixels wide).
+FACE_DETECTOR = "hog"
+HOG_UPSAMPLE = 0
+DOWNSCALE_FACTOR = 0.5
+HAAR_CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+# Multi-resolution mode: detect on a DETECTION_WIDTH-wide copy of the native
+# frame, then predict landmarks on a LANDMARK_CROP_SIZE square crop of the face
+# (grown by CROP_MARGIN on each side) taken from the native frame.
+DETECTION_WIDTH = 240
+LANDMARK_CROP_SIZE = 160
+CROP_MARGIN = 0.2
+
 # Facial landmark indices for eyes
 (LEFT_EYE_START, LEFT_EYE_END) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
 (RIGHT_EYE_START, RIGHT_EYE_END) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
 
-# Dlib face detector and landmark predictor
-Detector = dlib.get_frontal_face_detector()
-Predictor = dlib.shape_predictor("68_face_landmarks_shape_predictor.dat")
+# The 12 eye landmarks in the order used by eye-only stacks (right eye, then left eye)
+EYE_LANDMARK_INDICES = np.r_[RIGHT_EYE_START:RIGHT_EYE_END, LEFT_EYE_START:LEFT_EYE_END]
+
+# Dlib face detector and landmark predictor, loaded on first use (or by warm_up)
+PREDICTOR_PATH = "68_face_landmarks_shape_predictor.dat"
+
+detector = None
+predictor = None
+haar_cascade = None
+model_lock = Lock()
+
+
+def get_detector():
+    """Return the dlib face detector, building it on first use."""
+    global detector
+
+    if detector is None:
+        with model_lock:
+            if detector is None:
+                started_at = time.perf_counter()
+                detector = dlib.get_frontal_face_detector()
+                startup.record("build face detector", started_at)
+
+    return detector
+
+
+def haar_cascade_problem():
+    """Return why OpenCV's frontal-face Haar cascade cannot be used, or None if it can."""
+    if not hasattr(cv2, "CascadeClassifier"):
+        return f"OpenCV {cv2.__version__} has no CascadeClassifier"
+
+    directory = getattr(getattr(cv2, "data", None), "haarcascades", "")
+
+    if not os.path.isfile(os.path.join(directory, HAAR_CASCADE_FILE)):
+        return f"OpenCV {cv2.__version__} does not bundle {HAAR_CASCADE_FILE}"
+
+    return None
+
+
+def get_haar_cascade():
+    """Return OpenCV's frontal-face Haar cascade, loading it on first use."""
+    global haar_cascade
+
+    if haar_cascade is None:
+        with model_lock:
+            if haar_cascade is None:
+                started_at = time.perf_counter()
+                haar_cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, HAAR_CASCADE_FILE))
+                startup.record("load haar cascade", started_at)
+
+    return haar_cascade
+
+
+def get_predictor():
+    """Return the dlib landmark predictor, loading it from disk on first use."""
+    global predictor
+
+    if predictor is None:
+        with model_lock:
+            if predictor is None:
+                started_at = time.perf_counter()
+                predictor = dlib.shape_predictor(PREDICTOR_PATH)
+                startup.record("load shape predictor", started_at)
+
+    return predictor
+
+
+def warm_up():
+    """Load the detector and predictor and run them once so the first frame is not slow."""
+    started_at = time.perf_counter()
+    blank_frame = np.zeros((240, 320), dtype=np.uint8)
+
+    detect_faces(blank_frame)
+    get_predictor()(blank_frame, dlib.rectangle(80, 40, 240, 200))
+    startup.record("model warm-up", started_at)
+
+
+def warm_up_in_background():
+    """Start warm_up on a thread, e.g. while the camera opens, and return the thread."""
+    thread = Thread(target=warm_up, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def __getattr__(name):
+    """Keep the old module-level Detector and Predictor names working, loading lazily."""
+    if name == "Detector":
+        return get_detector()
+
+    if name == "Predictor":
+        return get_predictor()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def compute_distance(point_a, point_b):
@@ -22,22 +142,29 @@ def compute_distance(point_a, point_b):
 
 def calculate_eye_aspect_ratio(eye):
     """Calculate the Eye Aspect Ratio (EAR) for an eye."""
-    vertical_1 = compute_distance(eye[1], eye[5])
-    vertical_2 = compute_distance(eye[2], eye[4])
-    horizontal = compute_distance(eye[0], eye[3])
+    (vertical_1, vertical_2, horizontal) = np.linalg.norm(eye[[1, 2, 0]] - eye[[5, 4, 3]], axis=1)
     ear = (vertical_1 + vertical_2) / (2.0 * horizontal)
     return ear
 
 
-def calculate_average_ear(face_landmarks):
-    """Calculate the average EAR for both eyes."""
-    left_eye = face_landmarks[LEFT_EYE_START : LEFT_EYE_END]
-    right_eye = face_landmarks[RIGHT_EYE_START : RIGHT_EYE_END]
+def calculate_ear_batch(landmarks):
+    """Calculate the average EAR of every face in an (N, 68, 2) or (N, 12, 2) landmark stack."""
+    landmarks = np.asarray(landmarks, dtype=np.float64)
 
-    left_ear = calculate_eye_aspect_ratio(left_eye)
-    right_ear = calculate_eye_aspect_ratio(right_eye)
+    if landmarks.shape[-2] != len(EYE_LANDMARK_INDICES):
+        landmarks = landmarks[:, EYE_LANDMARK_INDICES]
 
-    return (left_ear + right_ear) / 2
+    # (N, eye, point, xy)
+    eyes = landmarks.reshape(-1, 2, 6, 2)
+    vertical = np.linalg.norm(eyes[:, :, [1, 2]] - eyes[:, :, [5, 4]], axis=-1).sum(axis=-1)
+    horizontal = np.linalg.norm(eyes[:, :, 0] - eyes[:, :, 3], axis=-1)
+
+    return (vertical / (2.0 * horizontal)).mean(axis=1)
+
+
+def calculate_average_ear(face_landmarks):
+    """Calculate the average EAR for both eyes from 68 or 12 (eye-only) landmarks."""
+    return float(calculate_ear_batch(face_landmarks[np.newaxis])[0])
 
 
 def is_drowsy(ear_value):
@@ -45,39 +172,369 @@ def is_drowsy(ear_value):
     return ear_value < EAR_THRESHOLD
 
 
-def draw_landmarks_on_face(face, landmarks):
-    """Draw landmarks on the face."""
-    face_with_landmarks = face.copy()
+# (dy, dx) offsets of the pixels in a landmark dot (a disc of radius 2)
+LANDMARK_DOT = tuple(offsets[np.hypot(*np.mgrid[-2:3, -2:3]) <= 2] for offsets in np.mgrid[-2:3, -2:3])
+LANDMARK_COLOR = (255, 255, 255)
+
+
+def draw_landmarks_on_face(face, landmarks, in_place=False, out=None):
+    """Draw landmarks on the face, on a copy unless drawing in place or into a given buffer."""
+    if in_place:
+        face_with_landmarks = face
+
+    elif out is not None:
+        np.copyto(out, face)
+        face_with_landmarks = out
+
+    else:
+        face_with_landmarks = face.copy()
 
-    for (x, y) in landmarks:
-        cv2.circle(
-            img=face_with_landmarks,
-            center=(x, y),
-            radius=2,
-            color=(255, 255, 255),
-            thickness=-1
-        )
+    # Paint every landmark's dot with a single fancy-indexed assignment,
+    # leaving out pixels outside the frame as cv2.circle does
+    (height, width) = face_with_landmarks.shape[:2]
+    ys = landmarks[:, 1, None] + LANDMARK_DOT[0]
+    xs = landmarks[:, 0, None] + LANDMARK_DOT[1]
+    inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    face_with_landmarks[ys[inside], xs[inside]] = LANDMARK_COLOR
 
     return face_with_landmarks
 
 
-def detect_first_face(resized_frame):
+def to_gray(resized_frame, gray_frame=None):
+    """Return the grayscale frame, converting only if the caller has not already done so."""
+    if gray_frame is None:
+        gray_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2GRAY)
+
+    return gray_frame
+
+
+DETECTOR_BACKENDS = {}
+
+# Backends this install cannot run, with the reason
+UNAVAILABLE_DETECTORS = {}
+
+
+def register_detector(name, problem=None):
+    """Register a function mapping a gray frame to a list of dlib rectangles as a backend.
+
+    If problem is given (e.g. a missing OpenCV module) the backend is recorded
+    as unavailable instead.
+    """
+    def decorator(function):
+        if problem is None:
+            DETECTOR_BACKENDS[name] = function
+
+        else:
+            UNAVAILABLE_DETECTORS[name] = problem
+
+        return function
+
+    return decorator
+
+
+@register_detector("hog")
+def detect_faces_hog(gray_frame):
+    """Detect faces with dlib's HOG detector."""
+    return list(get_detector()(gray_frame, HOG_UPSAMPLE))
+
+
+@register_detector("haar", problem=haar_cascade_problem())
+def detect_faces_haar(gray_frame):
+    """Detect faces with OpenCV's Haar cascade, largest first."""
+    boxes = get_haar_cascade().detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    boxes = sorted(boxes, key=lambda box: box[2] * box[3], reverse=True)
+
+    return [dlib.rectangle(int(x), int(y), int(x + w - 1), int(y + h - 1)) for (x, y, w, h) in boxes]
+
+
+@register_detector("hog_downscaled")
+def detect_faces_downscaled(gray_frame):
+    """Detect faces with HOG on a downscaled copy and map them back to the frame."""
+    # Too small to shrink, let alone to hold a face
+    if min(gray_frame.shape[:2]) * DOWNSCALE_FACTOR < 1:
+        return []
+
+    small_frame = cv2.resize(gray_frame, None, fx=DOWNSCALE_FACTOR, fy=DOWNSCALE_FACTOR,
+                             interpolation=cv2.INTER_AREA)
+
+    return [scale_rectangle(face, 1.0 / DOWNSCALE_FACTOR) for face in detect_faces_hog(small_frame)]
+
+
+def scale_rectangle(face, scale):
+    """Scale a rectangle's coordinates, e.g. to map it between resolutions."""
+    return dlib.rectangle(
+        int(round(face.left() * scale)),
+        int(round(face.top() * scale)),
+        int(round(face.right() * scale)),
+        int(round(face.bottom() * scale))
+    )
+
+
+def detect_faces(gray_frame, backend=None):
+    """Detect faces with the configured backend (or the one named), as dlib rectangles."""
+    name = backend or FACE_DETECTOR
+
+    try:
+        detect = DETECTOR_BACKENDS[name]
+
+    except KeyError:
+        if name in UNAVAILABLE_DETECTORS:
+            raise ValueError(f"Face detector {name!r} is unavailable: {UNAVAILABLE_DETECTORS[name]}") from None
+
+        raise ValueError(f"Unknown face detector {name!r}; choose one of {sorted(DETECTOR_BACKENDS)}") from None
+
+    return detect(gray_frame)
+
+
+def detect_first_face(resized_frame, gray_frame=None):
     """Process a single video frame to detect the first face."""
-    gray_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2GRAY)
+    started_at = time.perf_counter()
+    gray_frame = to_gray(resized_frame, gray_frame)
 
-    faces = Detector(gray_frame)
+    faces = detect_faces(gray_frame)
+    metrics.DETECTION_LATENCY.observe_since(started_at)
     return faces[0] if faces else None
 
 
-def resize_frame(frame, width=320, height=240):
-    """Resize the frame to a specific width and height."""
-    return cv2.resize(frame, (width, height))
+def to_rectangle(position):
+    """Round a dlib drectangle to the integer rectangle get_face_landmarks expects."""
+    return dlib.rectangle(
+        int(round(position.left())),
+        int(round(position.top())),
+        int(round(position.right())),
+        int(round(position.bottom()))
+    )
+
+
+def detect_face_near(gray_frame, face, margin=SEARCH_MARGIN):
+    """Detect a face only inside the given box grown by a margin on each side."""
+    (height, width) = gray_frame.shape[:2]
+    grow_x = int(face.width() * margin)
+    grow_y = int(face.height() * margin)
+
+    left = max(face.left() - grow_x, 0)
+    top = max(face.top() - grow_y, 0)
+    right = min(face.right() + grow_x, width)
+    bottom = min(face.bottom() + grow_y, height)
+
+    # The tracked box has drifted (partly) off the frame, leaving too little
+    # of it to hold the whole face
+    if right - left < face.width() or bottom - top < face.height():
+        return None
+
+    faces = detect_faces(gray_frame[top:bottom, left:right])
+
+    if not faces:
+        return None
+
+    return dlib.translate_rect(faces[0], dlib.point(left, top))
+
+
+class FaceTracker:
+    """Follow the first face between periodic detections instead of detecting every frame."""
+
+    def __init__(self, redetect_interval=REDETECT_INTERVAL, min_confidence=TRACKING_MIN_CONFIDENCE):
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+
+        self.tracker = None
+        self.last_face = None
+        self.frames_since_detection = 0
+
+        self.detections = 0
+        self.near_detections = 0
+        self.tracked_frames = 0
+
+    def detect(self, resized_frame, gray_frame=None):
+        """Return the face rectangle for a frame, tracking it when possible, or None."""
+        started_at = time.perf_counter()
+        face = self.locate(to_gray(resized_frame, gray_frame))
+        metrics.DETECTION_LATENCY.observe_since(started_at)
+        return face
+
+    def locate(self, gray_frame):
+        """Track the face, or detect it again when tracking is due or lost."""
+        face = None
+
+        if self.tracker is not None and self.frames_since_detection < self.redetect_interval:
+            confidence = self.tracker.update(gray_frame)
+
+            if confidence >= self.min_confidence:
+                self.frames_since_detection += 1
+                self.tracked_frames += 1
+                self.last_face = to_rectangle(self.tracker.get_position())
+                return self.last_face
+
+            # Lost track: the face is most likely still close to where it was
+            face = detect_face_near(gray_frame, self.last_face)
+            self.near_detections += 1
+
+        if face is None:
+            faces = detect_faces(gray_frame)
+            face = faces[0] if faces else None
+            self.detections += 1
+
+        self.start_tracking(gray_frame, face)
+        return face
+
+    def start_tracking(self, gray_frame, face):
+        """Restart the tracker on a freshly detected face (or stop it if there is none)."""
+        self.last_face = face
+        self.frames_since_detection = 0
+
+        if face is None:
+            self.tracker = None
+            return
+
+        self.tracker = dlib.correlation_tracker()
+        self.tracker.start_track(gray_frame, face)
+
+    def stats(self):
+        """Return counters for full detections, local searches and tracked frames."""
+        return {
+            "detections": self.detections,
+            "near_detections": self.near_detections,
+            "tracked_frames": self.tracked_frames,
+        }
+
+
+def resize_frame(frame, width=320, height=240, dst=None):
+    """Resize the frame to a specific width and height, into dst if given."""
+    return cv2.resize(frame, (width, height), dst=dst)
+
+
+class FrameContext:
+    """Preallocated resize and gray buffers reused for every frame.
 
+    The buffers rotate through `slots` sets so a frame handed to another thread stays
+    valid until that many newer frames have been prepared.
+    """
 
-def get_face_landmarks(resized_frame, face):
+    def __init__(self, width=320, height=240, slots=1):
+        self.size = (width, height)
+        self.buffers = [
+            (
+                np.empty((height, width, 3), dtype=np.uint8),
+                np.empty((height, width), dtype=np.uint8),
+            )
+            for _ in range(slots)
+        ]
+        self.slot = 0
+        (self.resized, self.gray) = self.buffers[0]
+
+    def prepare(self, frame):
+        """Resize a captured frame and convert it to grayscale once, in the next buffer set."""
+        self.slot = (self.slot + 1) % len(self.buffers)
+        (self.resized, self.gray) = self.buffers[self.slot]
+
+        resize_frame(frame, *self.size, dst=self.resized)
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        return self.resized
+
+
+def get_face_landmarks(resized_frame, face, gray_frame=None):
     """Get facial landmarks for a given face."""
-    gray_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2GRAY)
+    started_at = time.perf_counter()
+    gray_frame = to_gray(resized_frame, gray_frame)
 
     # using the model provided by dlib for faster and more accurate performance
-    landmarks = Predictor(gray_frame, face)
-    return face_utils.shape_to_np(landmarks)
\ No newline at end of file
+    landmarks = get_predictor()(gray_frame, face)
+    metrics.LANDMARK_LATENCY.observe_since(started_at)
+    return face_utils.shape_to_np(landmarks)
+
+
+def shape_to_eye_points(shape):
+    """Convert only the 12 eye landmarks of a dlib shape to a (12, 2) array."""
+    parts = [shape.part(int(i)) for i in EYE_LANDMARK_INDICES]
+    return np.array([(part.x, part.y) for part in parts], dtype=np.int32)
+
+
+def square_crop_box(face, width, height, margin=CROP_MARGIN):
+    """Return (left, top, side) of a square around a face that lies inside the frame."""
+    side = int(max(face.width(), face.height()) * (1.0 + 2.0 * margin))
+    side = max(min(side, width, height), 1)
+
+    center_x = (face.left() + face.right()) // 2
+    center_y = (face.top() + face.bottom()) // 2
+
+    # Shift rather than clip at the borders so the crop is never stretched
+    left = min(max(center_x - side // 2, 0), width - side)
+    top = min(max(center_y - side // 2, 0), height - side)
+
+    return (left, top, side)
+
+
+class MultiResolutionProcessor:
+    """Detect faces on a small frame and predict landmarks on a native-resolution face crop.
+
+    Landmarks are returned in native frame coordinates as floats; the EAR does not
+    depend on scale, so it can be computed from them directly.
+    """
+
+    def __init__(self, detection_width=DETECTION_WIDTH, crop_size=LANDMARK_CROP_SIZE, face_tracker=None):
+        self.detection_width = detection_width
+        self.crop_size = crop_size
+        self.face_tracker = face_tracker
+
+        # The detection buffers depend on the native aspect ratio, so they are
+        # allocated on the first frame
+        self.small_frame = None
+        self.small_gray = None
+        self.crop_frame = np.empty((crop_size, crop_size, 3), dtype=np.uint8)
+        self.crop_gray = np.empty((crop_size, crop_size), dtype=np.uint8)
+
+    def detect(self, frame):
+        """Detect (or track) the first face on a downscaled copy; return its native-scale box."""
+        (height, width) = frame.shape[:2]
+        detection_height = max(int(round(height * self.detection_width / width)), 1)
+
+        if self.small_frame is None or self.small_frame.shape[:2] != (detection_height, self.detection_width):
+            self.small_frame = np.empty((detection_height, self.detection_width, 3), dtype=np.uint8)
+            self.small_gray = np.empty((detection_height, self.detection_width), dtype=np.uint8)
+
+        cv2.resize(frame, (self.detection_width, detection_height), dst=self.small_frame,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small_frame, cv2.COLOR_BGR2GRAY, dst=self.small_gray)
+
+        if self.face_tracker is not None:
+            face = self.face_tracker.detect(self.small_frame, self.small_gray)
+
+        else:
+            face = detect_first_face(self.small_frame, self.small_gray)
+
+        if face is None:
+            return None
+
+        return scale_rectangle(face, width / self.detection_width)
+
+    def get_landmarks(self, frame, face):
+        """Predict landmarks on a normalized crop around a native-scale face box."""
+        started_at = time.perf_counter()
+        (height, width) = frame.shape[:2]
+        (left, top, side) = square_crop_box(face, width, height)
+
+        interpolation = cv2.INTER_AREA if side > self.crop_size else cv2.INTER_LINEAR
+        cv2.resize(frame[top:top + side, left:left + side], (self.crop_size, self.crop_size),
+                   dst=self.crop_frame, interpolation=interpolation)
+        cv2.cvtColor(self.crop_frame, cv2.COLOR_BGR2GRAY, dst=self.crop_gray)
+
+        scale = self.crop_size / side
+        crop_face = scale_rectangle(dlib.translate_rect(face, dlib.point(-left, -top)), scale)
+
+        landmarks = face_utils.shape_to_np(get_predictor()(self.crop_gray, crop_face)).astype(np.float32)
+        landmarks /= scale
+        landmarks += (left, top)
+
+        metrics.LANDMARK_LATENCY.observe_since(started_at)
+        return landmarks
+
+
+def get_eye_landmarks(resized_frame, face, gray_frame=None):
+    """Get only the eye landmarks for a given face, in EYE_LANDMARK_INDICES order."""
+    started_at = time.perf_counter()
+    gray_frame = to_gray(resized_frame, gray_frame)
+
+    landmarks = get_predictor()(gray_frame, face)
+    metrics.LANDMARK_LATENCY.observe_since(started_at)
+    return shape_to_eye_points(landmarks)
\ No newline at end of file
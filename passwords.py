@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import multiprocessing
+import os
+
+# bcrypt cost factor: each step doubles the time per hash and check. Existing
+# hashes keep the cost they were made with, so it can be changed at any time.
+BCRYPT_ROUNDS = 12
+
+# Worker processes, i.e. the most cores password hashing can take from the
+# detection loop, and how much lower their scheduling priority is
+POOL_SIZE = 1
+WORKER_NICENESS = 10
+
+pool = None
+pool_lock = Lock()
+
+
+def lower_priority():
+    """Worker initializer: let the detection loop win any contention for the CPU."""
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICENESS)
+
+
+def start(pool_size=POOL_SIZE):
+    """Start the worker pool if it is not already running and return it.
+
+    Call this before starting other threads: with the fork start method every
+    worker is created on the first submit, and forking a process that is
+    running other threads can copy their held locks into the workers.
+    """
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            context = None
+
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+
+            pool = ProcessPoolExecutor(max_workers=pool_size, mp_context=context, initializer=lower_priority)
+            pool.submit(int).result()
+
+    return pool
+
+
+def stop():
+    """Shut the worker pool down."""
+    global pool
+
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown()
+            pool = None
+
+
+def hash_in_worker(password, rounds):
+    """Hash a password with bcrypt; runs in a worker process."""
+    import bcrypt
+
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def check_in_worker(password, hashed_password):
+    """Check a password against a bcrypt hash; runs in a worker process."""
+    import bcrypt
+
+    return bcrypt.checkpw(password, hashed_password)
+
+
+def hash_password(password, rounds=None):
+    """Hash a plain text password in the worker pool, blocking until it is done."""
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+
+    return start().submit(hash_in_worker, password, rounds or BCRYPT_ROUNDS).result()
+
+
+def check_password(password, hashed_password):
+    """Return True if a plain text password matches a stored bcrypt hash."""
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode("utf-8")
+
+    return start().submit(check_in_worker, password, hashed_password).result()
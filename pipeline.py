@@ -0,0 +1,221 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+import logging
+import metrics
+import time
+
+# The capture stage keeps only the newest frame; older ones are dropped
+CAPTURE_QUEUE_SIZE = 1
+OUTPUT_QUEUE_SIZE = 4
+
+# How often blocked stages wake up to check whether the pipeline stopped
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+
+class StageStats:
+    """Throughput and drop counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self.busy_time = 0.0
+        self.started_at = time.monotonic()
+
+    def record(self, started_at):
+        """Count one processed item that started at the given perf_counter() time."""
+        self.processed += 1
+        self.busy_time += time.perf_counter() - started_at
+
+    def report(self):
+        """Return the stage's counters, its actual FPS and the FPS it could sustain alone."""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+
+        return {
+            "stage": self.name,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "fps": self.processed / elapsed,
+            "capacity_fps": self.processed / self.busy_time if self.busy_time else 0.0,
+        }
+
+
+def put_latest(queue, item, stats=None):
+    """Put an item, discarding the oldest queued item while the queue is full."""
+    while True:
+        try:
+            queue.put_nowait(item)
+            return
+
+        except Full:
+            try:
+                queue.get_nowait()
+
+                if stats is not None:
+                    stats.dropped += 1
+
+            except Empty:
+                pass
+
+
+class Pipeline:
+    """Run capture, inference and output as concurrent stages linked by bounded queues.
+
+    read_frame() returns (ret, frame) like cv2.VideoCapture.read, process_frame(frame,
+    captured_at) returns a result (captured_at is the time.monotonic() of the read), and
+    handle_result(result) returns False to stop the pipeline.
+    Every stage runs on a worker thread, leaving the thread that called start() free,
+    e.g. for GUI calls that some OpenCV backends only allow on the main thread.
+    """
+
+    def __init__(self, read_frame, process_frame, handle_result):
+        self.read_frame = read_frame
+        self.process_frame = process_frame
+        self.handle_result = handle_result
+
+        self.frames = Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        self.results = Queue(maxsize=OUTPUT_QUEUE_SIZE)
+        self.stop_event = Event()
+
+        self.stats = {name: StageStats(name) for name in ("capture", "inference", "output")}
+        self.workers = []
+
+    def start(self):
+        """Start every stage on a worker thread; the pipeline stops itself once the output stage ends."""
+        self.workers = [
+            Thread(target=self.capture_loop, name="capture", daemon=True),
+            Thread(target=self.inference_loop, name="inference", daemon=True),
+            Thread(target=self.output_loop, name="output", daemon=True),
+        ]
+
+        for worker in self.workers:
+            worker.start()
+
+        return self
+
+    def join(self):
+        """Wait for the pipeline to stop and its inference and output stages to finish."""
+        while not self.stop_event.wait(POLL_INTERVAL):
+            pass
+
+        # Those two always finish their current item; only a capture read may
+        # block indefinitely, so it gets a moment before being left behind
+        for worker in self.workers:
+            worker.join(1.0 if worker.name == "capture" else None)
+
+    def run(self):
+        """Run the pipeline until it ends, blocking the calling thread."""
+        self.start()
+        self.join()
+
+    def stop(self):
+        """Ask every stage to finish."""
+        self.stop_event.set()
+
+    def capture_loop(self):
+        """Read frames as fast as the source allows, keeping only the latest one."""
+        stats = self.stats["capture"]
+
+        try:
+            while not self.stop_event.is_set():
+                started_at = time.perf_counter()
+                (ret, frame) = self.read_frame()
+                captured_at = time.monotonic()
+
+                if not ret:
+                    break
+
+                stats.record(started_at)
+                metrics.FRAMES_CAPTURED.inc()
+
+                dropped = stats.dropped
+                put_latest(self.frames, (captured_at, frame), stats)
+                metrics.FRAMES_DROPPED.inc(stats.dropped - dropped)
+
+        except Exception:
+            logging.exception("Capture stage failed, stopping the pipeline")
+            self.stop()
+
+        finally:
+            put_latest(self.frames, _END)
+
+    def inference_loop(self):
+        """Turn the latest captured frame into a result for the output stage."""
+        stats = self.stats["inference"]
+
+        try:
+            while True:
+                item = self.get(self.frames)
+
+                if item is _END:
+                    break
+
+                (captured_at, frame) = item
+
+                started_at = time.perf_counter()
+                result = self.process_frame(frame, captured_at)
+                stats.record(started_at)
+
+                if not self.put(self.results, result):
+                    break
+
+        except Exception:
+            logging.exception("Inference stage failed, stopping the pipeline")
+            self.stop()
+
+        finally:
+            put_latest(self.results, _END)
+
+    def output_loop(self):
+        """Hand every result to handle_result until the stream ends or it asks to stop."""
+        stats = self.stats["output"]
+
+        try:
+            while True:
+                result = self.get(self.results)
+
+                if result is _END:
+                    break
+
+                started_at = time.perf_counter()
+                keep_running = self.handle_result(result)
+                stats.record(started_at)
+
+                if keep_running is False:
+                    break
+
+        except Exception:
+            logging.exception("Output stage failed, stopping the pipeline")
+
+        finally:
+            self.stop()
+
+    def get(self, queue):
+        """Block until an item is available, or return the end marker once stopped."""
+        while not self.stop_event.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+
+            except Empty:
+                continue
+
+        return _END
+
+    def put(self, queue, item):
+        """Block until there is room for an item; return False if the pipeline stopped."""
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+
+            except Full:
+                continue
+
+        return False
+
+    def log_stats(self):
+        """Log every stage's throughput and drop counts."""
+        for stats in self.stats.values():
+            logging.info(f"Pipeline stage stats: {stats.report()}")
@@ -0,0 +1,75 @@
+from threading import Event
+import numpy as np
+import logging
+import model
+import time
+import cv2
+
+# Preview windows are redrawn at most this often, whatever the pipeline FPS
+PREVIEW_FPS = 10.0
+
+
+class PreviewRenderer:
+    """Show the most recent result in preview windows, rendering on the thread that calls run().
+
+    The output stage only hands results over; run() picks up the newest one
+    PREVIEW_FPS times a second, so results in between are never drawn. Call
+    run() from the main thread: every GUI call happens there, which macOS and
+    some other OpenCV backends require.
+    """
+
+    def __init__(self, fps=PREVIEW_FPS, on_quit=None, stop_event=None):
+        self.interval = 1.0 / fps
+        self.on_quit = on_quit
+
+        self.latest = None
+        self.frame = None
+        self.overlay = None
+        self.frames_shown = 0
+
+        # Pass the pipeline's stop event so rendering ends with the pipeline
+        self.stop_event = Event() if stop_event is None else stop_event
+
+    def submit(self, result):
+        """Offer a result for display, replacing any not yet drawn; safe from any thread."""
+        self.latest = result
+
+    def stop(self):
+        """Make run() return and close the windows; safe from any thread."""
+        self.stop_event.set()
+
+    def run(self):
+        """Draw the newest result every interval until stopped or 'q' is pressed."""
+        next_frame_at = time.monotonic()
+
+        while not self.stop_event.wait(max(0.0, next_frame_at - time.monotonic())):
+            next_frame_at += self.interval
+            result = self.latest
+            self.latest = None
+
+            if result is not None:
+                self.draw(result)
+
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                logging.info("Preview closed with 'q'")
+
+                if self.on_quit is not None:
+                    self.on_quit()
+
+                break
+
+        cv2.destroyAllWindows()
+
+    def draw(self, result):
+        """Copy a result's frame out of the pipeline's buffers and show it with its landmarks."""
+        if self.frame is None or self.frame.shape != result["frame"].shape:
+            self.frame = np.empty_like(result["frame"])
+            self.overlay = np.empty_like(result["frame"])
+
+        np.copyto(self.frame, result["frame"])
+        cv2.imshow("Captured Frame", self.frame)
+
+        if result["face_landmarks"] is not None:
+            cv2.imshow("Face Landmarks", model.draw_landmarks_on_face(self.frame, result["face_landmarks"], out=self.overlay))
+
+        self.frames_shown += 1
@@ -0,0 +1,66 @@
+from threading import Thread, Event
+import logging
+import database
+
+# How often raw events are rolled up, and how long they are kept afterwards
+ROLLUP_INTERVAL = 60.0
+RETENTION_DAYS = 30
+
+stop_event = Event()
+rollup_thread = None
+
+
+def start(interval=ROLLUP_INTERVAL, retention_days=RETENTION_DAYS):
+    """Start the background rollup thread if it is not already running."""
+    global rollup_thread
+
+    if rollup_thread is None or not rollup_thread.is_alive():
+        stop_event.clear()
+        rollup_thread = Thread(target=run_rollup, args=(interval, retention_days), name="event-rollup", daemon=True)
+        rollup_thread.start()
+
+
+def stop(timeout=5.0):
+    """Stop the rollup thread after its current batch."""
+    global rollup_thread
+
+    if rollup_thread is None:
+        return
+
+    stop_event.set()
+    rollup_thread.join(timeout)
+    rollup_thread = None
+
+
+def rollup_once(retention_days=RETENTION_DAYS):
+    """Roll up every new raw event, then prune raw events past the retention window."""
+    success, message = database.rollup_drowsiness_events()
+
+    if not success:
+        logging.error(f"Event rollup failed: {message}")
+        return
+
+    logging.debug(message)
+
+    success, message = database.prune_drowsiness_events(retention_days * 86400)
+
+    if not success:
+        logging.error(f"Event pruning failed: {message}")
+        return
+
+    logging.debug(message)
+
+
+def run_rollup(interval, retention_days):
+    """Roll up and prune every `interval` seconds until stopped."""
+    while not stop_event.wait(interval):
+        rollup_once(retention_days)
+
+    database.close_connection()
+
+
+if __name__ == "__main__":
+    # Run a single pass, e.g. from cron
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(levelname)s %(message)s")
+    database.initialize_tables()
+    rollup_once()
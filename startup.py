@@ -0,0 +1,77 @@
+from threading import local
+import builtins
+import logging
+import time
+import sys
+
+# Importing this module starts the startup timeline. An entry point that also
+# wants import costs imports it first and calls install() before anything else.
+
+STARTED_AT = time.perf_counter()
+
+# (label, seconds since STARTED_AT, duration in seconds)
+timeline = []
+
+original_import = builtins.__import__
+import_depth = local()
+
+
+def record(label, started_at):
+    """Add a step that began at a time.perf_counter() reading and ends now."""
+    timeline.append((label, started_at - STARTED_AT, time.perf_counter() - started_at))
+
+
+def mark(label):
+    """Add an instantaneous milestone, such as the first processed frame."""
+    record(label, time.perf_counter())
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """builtins.__import__ replacement that records the cost of each new top-level import."""
+    if level or name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+
+    depth = getattr(import_depth, "value", 0)
+    import_depth.value = depth + 1
+    started_at = time.perf_counter()
+
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+
+    finally:
+        import_depth.value = depth
+
+        # Nested imports are included in the cost of the import that triggered them
+        if depth == 0:
+            record(f"import {name}", started_at)
+
+
+def install():
+    """Start timing every top-level import until stop_import_timer() is called."""
+    if builtins.__import__ is original_import:
+        builtins.__import__ = timed_import
+
+
+def stop_import_timer():
+    """Stop timing imports."""
+    if builtins.__import__ is timed_import:
+        builtins.__import__ = original_import
+
+
+def report():
+    """Return the timeline as text lines, ordered by start time."""
+    lines = [f"{'start ms':>10} {'took ms':>10}  step"]
+
+    for (label, offset, duration) in sorted(timeline, key=lambda step: step[1]):
+        lines.append(f"{offset * 1000.0:10.1f} {duration * 1000.0:10.1f}  {label}")
+
+    return lines
+
+
+def log_report():
+    """Stop timing imports and log the startup timeline."""
+    stop_import_timer()
+
+    for line in report():
+        logging.info(f"Startup: {line}")
+
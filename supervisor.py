@@ -0,0 +1,285 @@
+from multiprocessing.connection import wait
+import multiprocessing
+import argparse
+import logging
+import signal
+import struct
+import math
+import time
+import drowsiness_engine
+import event_writer
+import rollup
+import database
+import alarm
+import model
+import cv2
+
+# One fixed-size record per processed frame: stream id, frame index, timestamp,
+# EAR (NaN when no face), state code, detection ms, landmark ms
+RESULT_RECORD = struct.Struct("<HIdfBff")
+
+# Crashed workers are restarted after RESTART_DELAY seconds, doubling per
+# consecutive crash up to MAX_RESTART_DELAY
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+
+REPORT_SECONDS = 10.0
+
+# Workers are started (and restarted) after the aggregator's own threads are
+# running, so they must not be forked: a fork can copy locks those threads hold
+WORKER_START_METHOD = "spawn"
+
+
+def parse_source(text):
+    """Parse 'SOURCE' or 'SOURCE=USERNAME', where SOURCE is a device index or a file path."""
+    (source, _, username) = text.partition("=")
+    return (int(source) if source.isdigit() else source, username or None)
+
+
+def run_worker(stream_id, source, connection, stop_event):
+    """Analyze one video source and send a compact record per frame to the aggregator."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Loaded once per worker process, before the first frame
+    model.warm_up()
+
+    face_tracker = model.FaceTracker()
+    frame_context = model.FrameContext()
+    engine = drowsiness_engine.DrowsinessEngine()
+
+    capture = cv2.VideoCapture(source)
+    from_file = isinstance(source, str)
+    frame_index = 0
+
+    while not stop_event.is_set():
+        (ret, frame) = capture.read()
+
+        if not ret:
+            break
+
+        # Files are analyzed on their own timeline, cameras on the wall clock
+        timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if from_file else time.monotonic()
+
+        started_at = time.perf_counter()
+        resized_frame = frame_context.prepare(frame)
+        face = face_tracker.detect(resized_frame, frame_context.gray)
+        detected_at = time.perf_counter()
+
+        ear_value = math.nan
+
+        if face is not None:
+            eye_landmarks = model.get_eye_landmarks(resized_frame, face, frame_context.gray)
+            ear_value = model.calculate_average_ear(eye_landmarks)
+            engine.update(timestamp, ear_value)
+
+        landmarked_at = time.perf_counter()
+
+        connection.send_bytes(RESULT_RECORD.pack(
+            stream_id,
+            frame_index,
+            timestamp,
+            ear_value,
+            alarm.STATE_CODES[engine.state],
+            (detected_at - started_at) * 1000.0,
+            (landmarked_at - detected_at) * 1000.0,
+        ))
+        frame_index += 1
+
+    capture.release()
+    connection.close()
+
+
+class Stream:
+    """Aggregator-side state of one video source and its worker process."""
+
+    def __init__(self, stream_id, source, username=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.username = username
+
+        self.process = None
+        self.connection = None
+        self.finished = False
+        self.restarts = 0
+        self.consecutive_crashes = 0
+        self.restart_at = None
+
+        self.state = alarm.IDLE
+        self.frames = 0
+        self.detection_ms = 0.0
+        self.landmark_ms = 0.0
+
+
+class Supervisor:
+    """Run one worker process per video source and aggregate their results.
+
+    Workers only analyze frames; the aggregator owns the alarm and persistence,
+    restarts crashed workers and reports per-stream FPS.
+    """
+
+    def __init__(self, sources, alarm_backend=None):
+        self.streams = [
+            Stream(stream_id, source, username)
+            for (stream_id, (source, username)) in enumerate(sources)
+        ]
+        self.context = multiprocessing.get_context(WORKER_START_METHOD)
+        self.stop_event = self.context.Event()
+        self.alarm_controller = alarm.AlarmController(alarm.create_backend(alarm_backend))
+
+    def start_worker(self, stream):
+        """Start (or restart) the worker process of a stream."""
+        (receiver, sender) = self.context.Pipe(duplex=False)
+
+        stream.process = self.context.Process(
+            target=run_worker,
+            args=(stream.stream_id, stream.source, sender, self.stop_event),
+            name=f"stream-{stream.stream_id}",
+            daemon=True,
+        )
+        stream.process.start()
+
+        # Close our copy of the sending end so a dead worker shows up as EOF
+        sender.close()
+        stream.connection = receiver
+        stream.restart_at = None
+
+    def run(self):
+        """Supervise the workers until every stream ends or the user interrupts."""
+        database.initialize_tables()
+        event_writer.start()
+        rollup.start()
+        self.alarm_controller.start()
+
+        for stream in self.streams:
+            self.start_worker(stream)
+
+        next_report_at = time.monotonic() + REPORT_SECONDS
+
+        try:
+            while not all(stream.finished for stream in self.streams):
+                connections = [stream.connection for stream in self.streams if stream.connection is not None]
+
+                for connection in wait(connections, timeout=0.5):
+                    self.receive(connection)
+
+                self.check_workers()
+
+                if time.monotonic() >= next_report_at:
+                    self.report(REPORT_SECONDS)
+                    next_report_at += REPORT_SECONDS
+
+        except KeyboardInterrupt:
+            logging.info("Supervisor interrupted, stopping workers")
+
+        finally:
+            self.stop()
+
+    def receive(self, connection):
+        """Read every record waiting on a worker's connection."""
+        stream = next(stream for stream in self.streams if stream.connection is connection)
+
+        try:
+            while connection.poll():
+                self.handle_record(stream, RESULT_RECORD.unpack(connection.recv_bytes()))
+
+        except (EOFError, OSError):
+            connection.close()
+            stream.connection = None
+
+    def handle_record(self, stream, record):
+        """Update a stream from one worker record, then drive the alarm and persistence."""
+        (_, _, _, ear_value, state_code, detection_ms, landmark_ms) = record
+
+        stream.consecutive_crashes = 0
+        stream.frames += 1
+        stream.detection_ms += detection_ms
+        stream.landmark_ms += landmark_ms
+        stream.state = alarm.STATES_BY_CODE[state_code]
+
+        if stream.username is not None and not math.isnan(ear_value) and model.is_drowsy(ear_value):
+            event_writer.submit(ear_value, stream.username)
+
+        # The most severe state across all streams drives the single alarm
+        if any(other.state == alarm.ALARM for other in self.streams):
+            self.alarm_controller.post(alarm.ALARM)
+
+        elif any(other.state == alarm.WARNING for other in self.streams):
+            self.alarm_controller.post(alarm.WARNING)
+
+        else:
+            self.alarm_controller.post(alarm.IDLE)
+
+    def check_workers(self):
+        """Mark finished files and restart crashed workers (or lost cameras) with backoff."""
+        now = time.monotonic()
+
+        for stream in self.streams:
+            if stream.finished or stream.process.is_alive() or stream.connection is not None:
+                continue
+
+            if stream.process.exitcode == 0 and isinstance(stream.source, str):
+                stream.finished = True
+                stream.state = alarm.IDLE
+                logging.info(f"Stream {stream.stream_id} ({stream.source}) finished")
+
+            elif stream.restart_at is None:
+                delay = min(RESTART_DELAY * 2 ** stream.consecutive_crashes, MAX_RESTART_DELAY)
+                stream.consecutive_crashes += 1
+                stream.restarts += 1
+                stream.state = alarm.IDLE
+                stream.restart_at = now + delay
+                logging.warning(f"Stream {stream.stream_id} ({stream.source}) worker exited with code "
+                                f"{stream.process.exitcode}, restarting in {delay:.0f}s")
+
+            elif now >= stream.restart_at:
+                self.start_worker(stream)
+
+    def report(self, seconds):
+        """Log each stream's FPS and mean stage latencies since the last report."""
+        for stream in self.streams:
+            if stream.frames:
+                logging.info(
+                    f"Stream {stream.stream_id} ({stream.source}): {stream.frames / seconds:.1f} FPS, "
+                    f"detection {stream.detection_ms / stream.frames:.1f} ms, "
+                    f"landmarks {stream.landmark_ms / stream.frames:.1f} ms, "
+                    f"state {stream.state}, restarts {stream.restarts}"
+                )
+
+            else:
+                logging.info(f"Stream {stream.stream_id} ({stream.source}): no frames")
+
+            stream.frames = 0
+            stream.detection_ms = 0.0
+            stream.landmark_ms = 0.0
+
+    def stop(self):
+        """Stop every worker, then flush events and silence the alarm."""
+        self.stop_event.set()
+
+        for stream in self.streams:
+            if stream.process is not None:
+                stream.process.join(2.0)
+
+                if stream.process.is_alive():
+                    stream.process.terminate()
+
+        event_writer.stop()
+        rollup.stop()
+        self.alarm_controller.stop()
+
+
+def main():
+    """Parse command line arguments and supervise one worker per video source."""
+    parser = argparse.ArgumentParser(description="Analyze several cameras or video files at once.")
+    parser.add_argument("sources", nargs="+", metavar="SOURCE[=USERNAME]",
+                        help="camera index or video file, optionally with the driver to log events for")
+    parser.add_argument("--alarm-backend", choices=sorted(alarm.ALARM_BACKENDS), default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    Supervisor([parse_source(source) for source in args.sources], args.alarm_backend).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+from datetime import datetime
+import numpy as np
+import logging
+import struct
+import mmap
+import glob
+import time
+import os
+
+# One fixed-width little-endian record per frame: Unix timestamp, EAR (NaN
+# without a face), face found, frame skipped by adaptive sampling, alarm
+# state code, then detection, landmark and whole-frame processing times in ms
+RECORD = struct.Struct("<dfBBBfff")
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("ear", "<f4"),
+    ("face_found", "u1"),
+    ("skipped", "u1"),
+    ("state", "u1"),
+    ("detection_ms", "<f4"),
+    ("landmark_ms", "<f4"),
+    ("total_ms", "<f4"),
+])
+
+# Segment header: magic, format version, record size, capacity and the number
+# of records written (only updated when the segment is closed)
+HEADER = struct.Struct("<8sHHII")
+HEADER_SIZE = 64
+MAGIC = b"DDDSTLM1"
+FORMAT_VERSION = 1
+
+# About 9.7 hours at 30 FPS, 27 MB per segment
+SEGMENT_RECORDS = 1 << 20
+
+# The oldest segments are deleted so no more than this many are kept
+MAX_SEGMENTS = 32
+
+TELEMETRY_DIRECTORY = "telemetry"
+
+
+class TelemetryRecorder:
+    """Append per-frame records to preallocated, memory-mapped segment files.
+
+    Recording a frame is a single struct.pack_into() into the mapped segment;
+    nothing is formatted, flushed or written by this process's code. The OS
+    writes dirty pages back in the background. A full segment is closed and a
+    new one created in its place; closing truncates a segment to the records
+    written, and only the newest max_segments segments are kept.
+    """
+
+    def __init__(self, directory=TELEMETRY_DIRECTORY, segment_records=SEGMENT_RECORDS,
+                 max_segments=MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+
+        # Records carry Unix time, derived from the pipeline's monotonic timestamps
+        self.clock_offset = time.time() - time.monotonic()
+
+        self.pack_into = RECORD.pack_into
+        self.file = None
+        self.map = None
+        self.offset = 0
+        self.end = 0
+        self.segments = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.open_segment()
+
+    def open_segment(self):
+        """Create, preallocate and map the next segment file."""
+        self.delete_old_segments()
+
+        name = f"telemetry_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.segments:04d}.bin"
+        size = HEADER_SIZE + self.segment_records * RECORD.size
+
+        self.file = open(os.path.join(self.directory, name), "w+b")
+
+        # Reserve the blocks now rather than on each page's first write
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.file.fileno(), 0, size)
+
+        else:
+            self.file.truncate(size)
+
+        self.map = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, RECORD.size, self.segment_records, 0)
+
+        self.offset = HEADER_SIZE
+        self.end = size
+        self.segments += 1
+
+    def close_segment(self):
+        """Record the final count in the header, unmap the segment and free its unused tail."""
+        count = (self.offset - HEADER_SIZE) // RECORD.size
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, RECORD.size, self.segment_records, count)
+
+        self.map.close()
+        self.map = None
+        self.file.truncate(self.offset)
+        self.file.close()
+
+    def delete_old_segments(self):
+        """Delete the oldest segments, leaving room for one more within max_segments."""
+        paths = sorted(glob.glob(os.path.join(self.directory, "telemetry_*.bin")))
+
+        for path in paths[:max(len(paths) - self.max_segments + 1, 0)]:
+            try:
+                os.remove(path)
+
+            except OSError:
+                logging.exception(f"Failed to delete old telemetry segment {path}")
+
+    def record(self, captured_at, ear_value, face_found, skipped, state_code,
+               detection_ms, landmark_ms, total_ms):
+        """Append one frame's record; captured_at is a time.monotonic() reading."""
+        # Closed: the pipeline may still finish a frame while shutting down
+        if self.map is None:
+            return
+
+        if self.offset == self.end:
+            self.close_segment()
+            self.open_segment()
+
+        self.pack_into(self.map, self.offset, captured_at + self.clock_offset, ear_value,
+                       face_found, skipped, state_code, detection_ms, landmark_ms, total_ms)
+        self.offset += RECORD.size
+
+    def close(self):
+        """Close the current segment."""
+        if self.map is not None:
+            self.close_segment()
+
+
+def open_segment(path):
+    """Return a segment's records as a read-only NumPy structured array mapped from the file.
+
+    Nothing is copied: each field, e.g. records["ear"], is a strided view into
+    the mapping. Segments still being written can be opened too; they end at
+    the first record that has not been written yet.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    (magic, version, record_size, capacity, count) = HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} telemetry segment")
+
+    records = data[HEADER_SIZE:HEADER_SIZE + capacity * record_size].view(RECORD_DTYPE)
+
+    # An open (or crashed) segment has no count yet; unwritten records are zero
+    if not count:
+        unwritten = np.flatnonzero(records["timestamp"] == 0.0)
+        count = unwritten[0] if len(unwritten) else capacity
+
+    return records[:count]
+
+
+def open_segments(directory=TELEMETRY_DIRECTORY):
+    """Map every segment in a directory, oldest first."""
+    return [open_segment(path) for path in sorted(glob.glob(os.path.join(directory, "telemetry_*.bin")))]